@@ -0,0 +1,145 @@
+# Offline asset bake: scale the game's images to their final sizes once, pack the sprites into one atlas and save the screen-sized images per resolution,
+# with a manifest recording the content hash of every source so stale parts are rebuilt on the next bake (and skipped by the game until then)
+#
+# Usage:
+#   python bake_assets.py                                   # bake for the default resolutions, rebuilding only what is stale
+#   python bake_assets.py --resolution 2560x1440            # bake the screen-sized images for another resolution as well
+#   python bake_assets.py --force                           # rebuild everything
+#   python bake_assets.py --output baked                    # choose the bake directory
+
+import os
+import json
+import argparse
+
+import pygame
+import main
+
+# Resolutions the screen-sized images are baked for when none are given
+RESOLUTIONS = ["1024x768", "1280x720", "1920x1080"]
+
+# Width of the sprite atlas, and the gap left between packed images
+ATLAS_WIDTH = 1024
+ATLAS_PADDING = 1
+
+# Baked files are saved as uncompressed bitmaps: larger on disk than PNG, but loading them is little more than a copy
+ATLAS_FILE = "atlas.bmp"
+
+
+def pack(entries, width, padding):
+    # Place (path, size) entries on shelves from left to right, tallest first, and return their positions and the height used
+    positions = {}
+    x = y = shelf_height = 0
+    for image_path, size in sorted(entries, key=lambda entry: (-entry[1][1], -entry[1][0], entry[0])):
+        if x + size[0] > width:
+            x = 0
+            y += shelf_height + padding
+            shelf_height = 0
+        positions[(image_path, size)] = (x, y)
+        x += size[0] + padding
+        shelf_height = max(shelf_height, size[1])
+    return positions, y + shelf_height
+
+
+def scaled_image(image_path, size):
+    # Decode a source file and scale it to its final size, the way the game would at runtime
+    return pygame.transform.scale(pygame.image.load(image_path), size)
+
+
+def copy_into(target, image, position):
+    # Copy the pixels of an image into a transparent target unchanged (taking the maximum of zero and the source copies every channel exactly)
+    target.blit(image, position, special_flags=pygame.BLEND_RGBA_MAX)
+
+
+def bake_atlas(directory, images):
+    # Pack every sprite image into one atlas, each (path, size) once
+    placed, height = pack(set((image_path, tuple(size)) for image_path, size in images), ATLAS_WIDTH, ATLAS_PADDING)
+
+    # Draw the scaled images into the atlas and save it
+    atlas = pygame.Surface((ATLAS_WIDTH, height), pygame.SRCALPHA)
+    atlas.fill((0, 0, 0, 0))
+    for (image_path, size), position in placed.items():
+        copy_into(atlas, scaled_image(image_path, size), position)
+    pygame.image.save(atlas, os.path.join(directory, ATLAS_FILE))
+    return [{"path": image_path, "size": list(size), "file": ATLAS_FILE, "rect": [x, y, size[0], size[1]]} for (image_path, size), (x, y) in sorted(placed.items())]
+
+
+def bake_screen_image(directory, image_path, size):
+    # Save one screen-sized image on its own in the pixel format of its source, named after the source and size
+    file = "%s_%dx%d.bmp" % (os.path.splitext(image_path)[0], size[0], size[1])
+    pygame.image.save(scaled_image(image_path, size), os.path.join(directory, file))
+    return {"path": image_path, "size": list(size), "file": file, "rect": [0, 0, size[0], size[1]]}
+
+
+def read_manifest(directory):
+    # Read the manifest of an earlier bake, or return an empty one if there is none that can be used
+    try:
+        with open(os.path.join(directory, "manifest.json")) as file:
+            manifest = json.load(file)
+        if manifest.get("version") == main.BAKE_VERSION:
+            return manifest
+    except (OSError, ValueError):
+        pass
+    return {"version": main.BAKE_VERSION, "sources": {}, "images": []}
+
+
+def bake(directory, resolutions, force=False):
+    # Hash every source the bake needs and compare it with the earlier bake
+    os.makedirs(directory, exist_ok=True)
+    old = read_manifest(directory)
+    sprites = main.sprite_images()
+    screens = [(image_path, size) for width, height in resolutions for image_path, size, pixel_format in main.screen_images(width, height)]
+    sources = {image_path: main.BakedAssets.source_record(image_path) for image_path in sorted(set(image_path for image_path, size in sprites + screens))}
+    changed = set(image_path for image_path, record in sources.items() if force or old["sources"].get(image_path, {}).get("sha1") != record["sha1"])
+    old_images = {(entry["path"], tuple(entry["size"])): entry for entry in old["images"] if os.path.exists(os.path.join(directory, entry["file"]))}
+
+    # Rebuild the atlas if any sprite source changed or the set of sprites is different
+    atlas_keys = set((image_path, tuple(size)) for image_path, size in sprites)
+    old_atlas = [entry for key, entry in old_images.items() if entry["file"] == ATLAS_FILE]
+    if changed & set(image_path for image_path, size in sprites) or set((entry["path"], tuple(entry["size"])) for entry in old_atlas) != atlas_keys:
+        images = bake_atlas(directory, sprites)
+        print("Baked %s with %d images" % (ATLAS_FILE, len(images)))
+    else:
+        images = old_atlas
+        print("%s is up to date" % ATLAS_FILE)
+
+    # Rebuild each screen-sized image whose source changed or that was not baked yet
+    rebuilt = 0
+    for image_path, size in sorted(set(screens)):
+        entry = old_images.get((image_path, size))
+        if entry is None or entry["file"] == ATLAS_FILE or image_path in changed:
+            entry = bake_screen_image(directory, image_path, size)
+            rebuilt += 1
+        images.append(entry)
+    print("Baked %d of %d screen-sized images for %s" % (rebuilt, len(set(screens)), ", ".join("%dx%d" % resolution for resolution in resolutions)))
+
+    # Keep the screen-sized images of other resolutions baked earlier, as long as their source did not change
+    for key, entry in sorted(old_images.items()):
+        if entry["file"] != ATLAS_FILE and key not in set(screens) and key[0] in sources and key[0] not in changed:
+            images.append(entry)
+
+    # Write the manifest last, so an interrupted bake never claims files it did not finish
+    manifest = {"version": main.BAKE_VERSION, "sources": sources, "images": sorted(images, key=lambda entry: (entry["file"], entry["path"], entry["size"]))}
+    with open(os.path.join(directory, "manifest.json"), "w") as file:
+        json.dump(manifest, file, indent=1)
+    return manifest
+
+
+def parse_resolution(text):
+    # Read a resolution written as WIDTHxHEIGHT
+    width, height = text.lower().split("x")
+    return int(width), int(height)
+
+
+def main_bake():
+    # Read the command line options
+    parser = argparse.ArgumentParser(description="Bake the game's images at their final sizes into an atlas and per-resolution files.")
+    parser.add_argument("--resolution", action="append", type=parse_resolution, help="screen resolution to bake the screen-sized images for, as WIDTHxHEIGHT (can be repeated)")
+    parser.add_argument("--output", default=main.BAKE_DIRECTORY, help="directory the bake is written to")
+    parser.add_argument("--force", action="store_true", help="rebuild everything, even the parts that are up to date")
+    args = parser.parse_args()
+
+    bake(args.output, args.resolution or [parse_resolution(text) for text in RESOLUTIONS], args.force)
+
+
+if __name__ == "__main__":
+    main_bake()
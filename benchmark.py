@@ -0,0 +1,278 @@
+# Benchmark suite for the phases of the game loop (sprite update, collisions, item checks and rendering)
+#
+# Usage:
+#   python benchmark.py                                  # run the 1k, 10k and 100k presets
+#   python benchmark.py --preset 1m --frames 120         # run a single preset
+#   python benchmark.py --blocks 5000 --enemies 2000     # run a custom level
+#   python benchmark.py --output bench_results.json      # choose where the results are written
+#   python benchmark.py --replay session.min             # time the frames of a recorded session
+#   python benchmark.py --characters 4096                # time many characters stepped at once by the character batch
+
+import json
+import time
+import random
+import argparse
+import platform
+
+import pygame
+import main
+
+# NumPy is optional; it is only needed for the character batch
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Number of synthetic blocks, enemies, items and clouds added on top of the normal level for each preset
+PRESETS = {
+    "1k": (500, 200, 100, 200),
+    "10k": (5000, 2000, 1000, 2000),
+    "100k": (50000, 20000, 10000, 20000),
+    "1m": (500000, 200000, 100000, 200000),
+}
+
+# Names of the timed phases, in the order they run in a frame
+PHASES = ["update", "collisions", "items", "render"]
+
+# Phases the game's own frame profiler marks that make up each timed phase (update covers the sprites, the item effects, the camera, level streaming and the cloud pool)
+PROFILER_PHASES = {"update": ["sprites", "timer", "level", "clouds"], "collisions": ["collisions"], "items": ["items"], "render": ["draw"]}
+
+
+def build_synthetic_level(game, blocks, enemies, items, clouds, rng):
+    # Make the level long enough to spread the extra content at roughly the density of the normal level
+    columns = 400 + (blocks + enemies + items + clouds) // 8
+
+    # Lay continuous ground under every column the normal level leaves empty, so the character never falls
+    for column in range(-6, columns):
+        if not game.level.has_ground(column):
+            for row, image_path in ((1, "img_block_dirt.png"), (2, "img_block_dirt.png"), (3, "img_block_grass.png")):
+                game.add_ground(main.Scale_Block(image_path, column * main.BLOCK_SIZE, main.SCREEN_HEIGHT - row * main.BLOCK_SIZE, main.BLOCK_SIZE, main.BLOCK_SIZE))
+
+    # Add bricks and question blocks at random heights
+    for _ in range(blocks):
+        x = rng.randint(5, columns) * main.BLOCK_SIZE
+        y = rng.randint(main.SCREEN_HEIGHT // 2, main.SCREEN_HEIGHT - 5 * main.BLOCK_SIZE)
+        if rng.randint(1, 2) == 2:
+            game.add_block(main.Question_Block(x, y))
+        else:
+            game.add_block(main.Scale_Block("img_block_brick.png", x, y, main.BLOCK_SIZE, main.BLOCK_SIZE))
+
+    # Add patrolling enemies standing on the ground
+    enemy_types = [("img_enemy_mushroom.png", 1), ("img_enemy_robot.png", 2), ("img_enemy_orc.png", 3)]
+    for _ in range(enemies):
+        image_path, number = rng.choice(enemy_types)
+        game.add_enemy(image_path, rng.randint(9, columns) * main.BLOCK_SIZE, main.SCREEN_HEIGHT - 4 * main.BLOCK_SIZE, 100 * number, number, number * 0.75)
+
+    # Add items lying around the level
+    item_types = [main.HighJumpItem, main.SpeedUpItem, main.MuscleUpItem, main.IronBodyItem, main.ConfusionItem, main.RecoveryItem]
+    for _ in range(items):
+        item = rng.choice(item_types)(rng.randint(5, columns) * main.BLOCK_SIZE, rng.randint(main.SCREEN_HEIGHT // 2, main.SCREEN_HEIGHT - 4 * main.BLOCK_SIZE))
+        game.items.add(item)
+        game.add_sprite(item, layer=main.LAYER_ITEMS)
+
+    # Grow the game's recycled cloud pool by as many clouds as a screen would show if the extra clouds were spread over the level, split over the depths
+    extra = round(clouds * main.SCREEN_WIDTH / (columns * main.BLOCK_SIZE))
+    depths = [(factor, size, count + extra // len(main.CLOUD_DEPTHS) + (1 if depth < extra % len(main.CLOUD_DEPTHS) else 0)) for depth, (factor, size, count) in enumerate(main.CLOUD_DEPTHS)]
+    game.cloud_layer = main.CloudLayer(main.SCREEN_WIDTH, main.SCREEN_HEIGHT, random.Random(rng.getrandbits(32)), depths)
+
+    # Keep the character alive for the whole run
+    game.character.immune_to_damage = True
+    game.character.health = game.character.max_health = 10 ** 9
+
+
+def percentile(samples, percent):
+    # Get the sample at the given percentile of a sorted list
+    index = min(len(samples) - 1, int(round(percent / 100 * (len(samples) - 1))))
+    return samples[index]
+
+
+def summarize(samples):
+    # Summarize a list of durations in seconds as milliseconds
+    samples = sorted(samples)
+    return {
+        "mean_ms": sum(samples) / len(samples) * 1000,
+        "p50_ms": percentile(samples, 50) * 1000,
+        "p99_ms": percentile(samples, 99) * 1000,
+        "max_ms": samples[-1] * 1000,
+    }
+
+
+def run_scenario(name, blocks, enemies, items, clouds, frames, warmup, seed, batched_enemies):
+    # Build the whole level up front (no streaming) and count what ended up in it
+    build_start = time.perf_counter()
+    game = main.Game(headless=True, seed=seed, batched_enemies=batched_enemies, stream_level=False)
+    build_synthetic_level(game, blocks, enemies, items, clouds, random.Random(seed))
+    build_time = time.perf_counter() - build_start
+    sprite_count = len(game.all_sprites) + len([block for block in game.blocks if not game.all_sprites.has(block)])
+    if game.enemy_store is not None:
+        sprite_count += len(game.enemy_store)
+
+    # Time each phase of every frame while the character runs right and jumps now and then
+    timings = {phase: [] for phase in PHASES}
+    frame_times = []
+    profiler = game.profiler
+    for frame in range(warmup + frames):
+        keys = {pygame.K_RIGHT, pygame.K_UP} if frame % 40 < 5 else {pygame.K_RIGHT}
+        game.character.keys = main.KeyState(keys)
+
+        # Run the same update and draw as a frame of the game loop, timed by the game's own frame profiler
+        profiler.begin_frame()
+        game.update()
+        game.draw()
+        profiler.end_frame()
+        durations = {}
+        for phase, start, duration in profiler.phases:
+            durations[phase] = durations.get(phase, 0) + duration
+
+        # Leave the warm-up frames out of the results
+        if frame >= warmup:
+            for phase in PHASES:
+                timings[phase].append(sum(durations.get(name, 0) for name in PROFILER_PHASES[phase]))
+            frame_times.append(sum(durations.values()))
+
+    # Report the phase timings, frame times and frames per second
+    frame_summary = summarize(frame_times)
+    return {
+        "name": name,
+        "counts": {"blocks": blocks, "enemies": enemies, "items": items, "clouds": clouds, "pooled_clouds": len(game.cloud_layer.clouds), "sprites": sprite_count},
+        "batched_enemies": game.enemy_store is not None,
+        "frames": frames,
+        "build_s": build_time,
+        "phases": {phase: summarize(timings[phase]) for phase in PHASES},
+        "frame": frame_summary,
+        "fps": frames / sum(frame_times),
+    }
+
+
+def run_replay(path, batched_enemies):
+    # Replay a recorded session headless, timing every physics step from one step's start to the next
+    recording = main.InputRecording.load(path)
+    starts = []
+    game, frames = recording.replay(lambda game: starts.append(time.perf_counter()), batched_enemies=batched_enemies)
+    starts.append(time.perf_counter())
+    frame_times = [end - start for start, end in zip(starts, starts[1:])]
+
+    # Report the frame times and frames per second
+    return {
+        "name": path,
+        "replay": True,
+        "batched_enemies": game.enemy_store is not None,
+        "frames": frames,
+        "outcome": game.outcome,
+        "frame": summarize(frame_times),
+        "fps": frames / sum(frame_times),
+    }
+
+
+def character_level(seed):
+    # Build a whole level without enemies, so only the character physics and its blocks run
+    game = main.Game(headless=True, silent=True, seed=seed, stream_level=False)
+    for enemy in list(game.enemies):
+        game.remove_enemy(enemy)
+    return game
+
+
+def character_inputs(count, steps, seed):
+    # Random input masks per step and character: mostly running right, sometimes left, with jumps now and then
+    rng = np.random.default_rng(seed)
+    direction = np.where(rng.random((steps, count)) < 0.15, main.INPUT_LEFT, main.INPUT_RIGHT)
+    jump = np.where(rng.random((steps, count)) < 0.08, main.INPUT_UP, 0)
+    return direction | jump
+
+
+def run_character_batch(count, steps, seed, checked):
+    # Time stepping every character of the batch at once on a single core
+    game = character_level(seed)
+    masks = character_inputs(count, steps, seed)
+    batch = main.CharacterBatch.from_game(game, count)
+    start = time.perf_counter()
+    for step in range(steps):
+        batch.step(masks[step])
+    elapsed = time.perf_counter() - start
+
+    # Step the first characters one at a time through the game's own per-sprite path and check they end up the same
+    for index in range(min(checked, count)):
+        game = character_level(seed)
+        character = game.character
+        for step in range(steps):
+            character.keys = main.KeyState.from_mask(int(masks[step, index]))
+            character.update()
+            game.check_collisions()
+        if (character.rect.topleft, character.on_ground, character.jump_count, character.speed_y) != (batch.rect(index).topleft, batch.on_ground[index], batch.jump_count[index], batch.speed_y[index]):
+            raise ValueError("Character %d of the batch ended at %s, the per-sprite path at %s" % (index, batch.rect(index).topleft, character.rect.topleft))
+
+    # Report the throughput in character steps per second
+    return {
+        "name": "characters-%d" % count,
+        "characters": count,
+        "steps": steps,
+        "checked": min(checked, count),
+        "fallen": int(np.count_nonzero(batch.is_game_over)),
+        "furthest_x": int(batch.x.max()),
+        "character_steps_per_s": count * steps / elapsed,
+    }
+
+
+def main_benchmark():
+    # Read the command line options
+    parser = argparse.ArgumentParser(description="Benchmark the update, collision and render phases of the game loop.")
+    parser.add_argument("--preset", action="append", choices=sorted(PRESETS), help="preset level size (can be repeated)")
+    parser.add_argument("--blocks", type=int, help="number of extra blocks for a custom level")
+    parser.add_argument("--enemies", type=int, default=0, help="number of extra enemies for a custom level")
+    parser.add_argument("--items", type=int, default=0, help="number of extra items for a custom level")
+    parser.add_argument("--clouds", type=int, default=0, help="number of extra clouds for a custom level")
+    parser.add_argument("--frames", type=int, default=600, help="number of timed frames per level")
+    parser.add_argument("--warmup", type=int, default=30, help="number of untimed frames before timing starts")
+    parser.add_argument("--batched-enemies", action="store_true", help="keep the enemies in the NumPy enemy store")
+    parser.add_argument("--seed", type=int, default=1, help="seed of the level and the synthetic content")
+    parser.add_argument("--replay", action="append", help="input recording to replay and time (can be repeated)")
+    parser.add_argument("--characters", type=int, action="append", help="number of characters to step at once in the character batch (can be repeated)")
+    parser.add_argument("--checked", type=int, default=4, help="number of batch characters checked against the per-sprite path")
+    parser.add_argument("--output", default="bench_results.json", help="file the results are written to")
+    args = parser.parse_args()
+
+    # Pick the levels to run (none when only recordings are replayed)
+    if args.blocks is not None or args.enemies or args.items or args.clouds:
+        scenarios = [("custom", args.blocks or 0, args.enemies, args.items, args.clouds)]
+    elif (args.replay or args.characters) and not args.preset:
+        scenarios = []
+    else:
+        scenarios = [(name,) + PRESETS[name] for name in (args.preset or ["1k", "10k", "100k"])]
+
+    # Run every level and print a short line per level
+    results = []
+    for name, blocks, enemies, items, clouds in scenarios:
+        result = run_scenario(name, blocks, enemies, items, clouds, args.frames, args.warmup, args.seed, args.batched_enemies)
+        results.append(result)
+        phases = "  ".join("%s p50 %.3f ms p99 %.3f ms" % (phase, result["phases"][phase]["p50_ms"], result["phases"][phase]["p99_ms"]) for phase in PHASES)
+        print("%-6s %8d sprites  %8.1f fps  frame p50 %.3f ms p99 %.3f ms  %s" % (name, result["counts"]["sprites"], result["fps"], result["frame"]["p50_ms"], result["frame"]["p99_ms"], phases))
+
+    # Replay every recording and print a short line per recording
+    for path in args.replay or []:
+        result = run_replay(path, args.batched_enemies)
+        results.append(result)
+        print("%s  %8d frames  %8.1f fps  frame p50 %.3f ms p99 %.3f ms  outcome %s" % (path, result["frames"], result["fps"], result["frame"]["p50_ms"], result["frame"]["p99_ms"], result["outcome"]))
+
+    # Step every character batch and print a short line per batch
+    for count in args.characters or []:
+        result = run_character_batch(count, args.frames, args.seed, args.checked)
+        results.append(result)
+        print("%6d characters  %6d steps  %12.0f character steps/s  %d fallen  furthest x %d  (%d checked against the per-sprite path)" % (
+            count, result["steps"], result["character_steps_per_s"], result["fallen"], result["furthest_x"], result["checked"]))
+
+    # Write the results to a machine-readable file so versions can be compared
+    report = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "pygame": pygame.version.ver,
+        "platform": platform.platform(),
+        "screen": [main.SCREEN_WIDTH, main.SCREEN_HEIGHT],
+        "results": results,
+    }
+    with open(args.output, "w") as file:
+        json.dump(report, file, indent=2)
+    print("Results written to " + args.output)
+
+
+if __name__ == "__main__":
+    main_benchmark()
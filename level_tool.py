@@ -0,0 +1,111 @@
+# Level file tool: export generated levels as binary level files, inspect them, and benchmark loading them
+#
+# Usage:
+#   python level_tool.py export level.mlv --seed 7                 # save the level a seeded game would play
+#   python level_tool.py export long.mlv --seed 7 --length 20000   # save a longer level
+#   python level_tool.py info level.mlv                            # print the header and chunk table of a level file
+#   python level_tool.py bench --length 300 --length 100000        # compare loading level files with generating levels
+
+import os
+import time
+import argparse
+import tempfile
+
+import main
+
+
+def export_level(path, seed, length):
+    # Generate the level of a seeded game and save it, naming the level seed stored in the file (the one info prints) next to the game seed it came from
+    game = main.Game(headless=True, seed=seed, level_length=length)
+    game.export_level(path)
+    print("Saved level seed %d of game seed %s (%d blocks long) to %s, %d bytes" % (game.level.seed, seed, length, path, os.path.getsize(path)))
+
+
+def print_level_info(path):
+    # Print the header of the level file and a summary of every chunk
+    level = main.LevelFile(path)
+    print("%s: version %d, seed %d, length %d, chunks %d to %d of %d columns, %d grid rows" % (path, main.LEVEL_VERSION, level.seed, level.length, level.first_chunk, level.last_chunk, level.chunk_columns, level.rows))
+    print("images: " + ", ".join(level.images))
+    for index in range(level.first_chunk, level.last_chunk + 1):
+        offset, entity_count = level.chunk_entry(index)
+        kinds = [entity[0] for entity in level.chunk(index)]
+        print("chunk %4d at %8d: %3d ground tiles, %d entities (%s)" % (index, offset, kinds.count("ground"), entity_count, ", ".join(kind for kind in kinds if kind != "ground")))
+    level.close()
+
+
+def benchmark_length(length, seed, view_chunks):
+    # Time generating every chunk of a procedural level
+    level = main.ProceduralLevel(seed, length)
+    chunks = range(level.first_chunk, level.last_chunk + 1)
+    start = time.perf_counter()
+    for index in chunks:
+        level.chunk(index)
+    generate_all = time.perf_counter() - start
+
+    # Time saving the level
+    path = os.path.join(tempfile.mkdtemp(), "level.mlv")
+    start = time.perf_counter()
+    main.LevelFile.save(level, path)
+    save = time.perf_counter() - start
+
+    # Time opening the file and reading the chunks the first screen needs, then reading every chunk
+    start = time.perf_counter()
+    level_file = main.LevelFile(path)
+    for index in range(level_file.first_chunk, min(level_file.first_chunk + view_chunks, level_file.last_chunk + 1)):
+        level_file.chunk(index)
+    open_first_screen = time.perf_counter() - start
+    start = time.perf_counter()
+    for index in chunks:
+        level_file.chunk(index)
+    read_all = time.perf_counter() - start
+
+    # Check that the file holds exactly the generated level
+    for index in chunks:
+        if level_file.chunk(index) != level.chunk(index):
+            raise ValueError("Chunk %d of the level file differs from the generated level" % index)
+    size = os.path.getsize(path)
+    level_file.close()
+    os.remove(path)
+    os.rmdir(os.path.dirname(path))
+
+    return {
+        "length": length,
+        "chunks": len(chunks),
+        "bytes": size,
+        "generate_all_ms": generate_all * 1000,
+        "save_ms": save * 1000,
+        "open_first_screen_ms": open_first_screen * 1000,
+        "read_all_ms": read_all * 1000,
+    }
+
+
+def main_tool():
+    # Read the command line options
+    parser = argparse.ArgumentParser(description="Export, inspect and benchmark binary level files.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    export = commands.add_parser("export", help="save the level of a seeded game")
+    export.add_argument("path", help="level file to write")
+    export.add_argument("--seed", type=int, default=1, help="seed of the game whose level is saved")
+    export.add_argument("--length", type=int, default=main.LEVEL_LENGTH, help="column of the castle at the end of the level")
+    info = commands.add_parser("info", help="print the contents of a level file")
+    info.add_argument("path", help="level file to read")
+    bench = commands.add_parser("bench", help="compare loading level files with generating levels")
+    bench.add_argument("--length", type=int, action="append", help="level length to benchmark (can be repeated)")
+    bench.add_argument("--seed", type=int, default=1, help="seed of the generated levels")
+    args = parser.parse_args()
+
+    if args.command == "export":
+        export_level(args.path, args.seed, args.length)
+    elif args.command == "info":
+        print_level_info(args.path)
+    else:
+        # The first screen needs the chunks covering the screen plus the streamer's look-ahead
+        view_chunks = main.SCREEN_WIDTH // (main.CHUNK_COLUMNS * main.BLOCK_SIZE) + 4
+        for length in args.length or [main.LEVEL_LENGTH, 10000, 100000]:
+            result = benchmark_length(length, args.seed, view_chunks)
+            print("length %7d  %6d chunks  %9d bytes  generate all %9.2f ms  save %9.2f ms  open + first screen %6.3f ms  read all %9.2f ms" % (
+                result["length"], result["chunks"], result["bytes"], result["generate_all_ms"], result["save_ms"], result["open_first_screen_ms"], result["read_all_ms"]))
+
+
+if __name__ == "__main__":
+    main_tool()
@@ -1,17 +1,35 @@
+import time
+
+# Time at which the game module started loading, for the cold-start report
+MODULE_START = time.perf_counter()
+
+import os
 import pygame
 import sys
+import json
+import argparse
+import mmap
+import struct
 import random
-
-# Set the caption of the game window
-pygame.display.set_caption("Mighty Action Game")
-
-# Initialize all imported pygame modules
-pygame.init()
-
-# Get the current screen width and height
-info = pygame.display.Info()
-SCREEN_WIDTH = info.current_w
-SCREEN_HEIGHT = info.current_h
+import bisect
+import heapq
+import hashlib
+import cProfile
+from collections import deque, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+# NumPy is optional; it is only needed for the batched enemy store and the character batch
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Run without a display or sound card when MIGHTY_HEADLESS=1 is set (CI and batch simulations)
+HEADLESS = os.environ.get("MIGHTY_HEADLESS") == "1"
+
+# Screen width and height, read from the display by init_display (these defaults are used until then)
+SCREEN_WIDTH = 1024
+SCREEN_HEIGHT = 768
 
 # Define color constants using RGB values
 LIGHT_BLUE = (0, 165, 255)
@@ -26,6 +44,677 @@ DARKER_GRAY = (100, 100, 100)
 # Set the block size for game elements
 BLOCK_SIZE = 64
 
+# Parallax cloud depths as (scroll factor, cloud size, number of pooled clouds), farthest first
+CLOUD_DEPTHS = [(0.3, 40, 5), (0.6, 52, 5), (1.0, BLOCK_SIZE, 5)]
+
+# Width of one streamed level chunk in blocks, and the column of the castle at the end of the level
+CHUNK_COLUMNS = 16
+LEVEL_LENGTH = 300
+
+# Binary level file layout: header, image paths, chunk index, then per chunk a tile grid and an entity table
+LEVEL_MAGIC = b"MGLV"
+LEVEL_VERSION = 1
+LEVEL_HEADER = struct.Struct("<4sHQiiIHHH")  # magic, version, seed, length, first chunk, chunk count, chunk columns, block size, grid rows
+LEVEL_INDEX_ENTRY = struct.Struct("<II")  # chunk offset, number of entities
+LEVEL_ENTITY = struct.Struct("<BBiiHHf")  # kind, image, x, height above the bottom of the screen, movement range, max health, speed
+LEVEL_ENTITY_KINDS = ["brick", "question", "enemy", "castle"]
+
+# Bits of the input masks stored in input recordings (a mask with a menu action is an entry of its own, not a physics step)
+INPUT_LEFT, INPUT_RIGHT, INPUT_UP, INPUT_PAUSE, INPUT_CONTINUE, INPUT_EXIT = 1, 2, 4, 8, 16, 32
+INPUT_KEYS = {pygame.K_LEFT: INPUT_LEFT, pygame.K_RIGHT: INPUT_RIGHT, pygame.K_UP: INPUT_UP}
+
+# Input recording file layout: header, settings of the recorded game as JSON, then runs of (input mask, frames)
+INPUT_MAGIC = b"MGIN"
+INPUT_VERSION = 3
+INPUT_HEADER = struct.Struct("<4sHI")  # magic, version, settings size
+INPUT_RUN = struct.Struct("<BH")  # input mask, number of frames it was held
+
+# Directory of the offline asset bake written by bake_assets.py, and the version of its manifest
+BAKE_DIRECTORY = "baked"
+BAKE_VERSION = 1
+
+# Mixer channels owned by the voice manager
+VOICE_CHANNELS = 8
+
+# Voice settings of the sound effects as (priority, instances playing at once, seconds in which a repeated trigger is dropped);
+# a sound takes the channel of a lower or equal priority voice when none is free, so the stingers always get one
+SOUND_VOICES = {
+    "audio_game_over.mp3": (3, 1, 0.0),
+    "audio_winner.mp3": (3, 1, 0.0),
+    "audio_starter.mp3": (2, 1, 0.0),
+    "audio_pause.mp3": (2, 1, 0.0),
+    "audio_continue.mp3": (2, 1, 0.0),
+    "audio_exit.mp3": (2, 1, 0.0),
+    "audio_killing.mp3": (1, 2, 0.05),
+    "audio_power_up.mp3": (1, 1, 0.1),
+    "audio_power_down.mp3": (1, 1, 0.1),
+    "audio_recovery.mp3": (1, 1, 0.1),
+    "audio_jumping.mp3": (0, 1, 0.05),
+    "audio_break.mp3": (0, 2, 0.05),
+    "audio_hitting.mp3": (0, 1, 0.35),
+}
+DEFAULT_VOICE = (0, 2, 0.05)
+
+# Rate the physics was tuned for: speeds, gravity and timers are given per step at this rate
+BASE_PHYSICS_HZ = 60
+
+# Draw layers of the sprites, back to front
+LAYER_BLOCKS, LAYER_ENEMIES, LAYER_CHARACTER, LAYER_CASTLE, LAYER_ITEMS = range(5)
+
+
+def file_digest(path):
+    # Hash the content of a file, to tell whether a baked image is still up to date with its source
+    with open(path, "rb") as file:
+        return hashlib.sha1(file.read()).hexdigest()
+
+
+class BakedAssets:
+    def __init__(self, directory):
+        # Read the manifest written by bake_assets.py
+        self.directory = directory
+        with open(os.path.join(directory, "manifest.json")) as file:
+            manifest = json.load(file)
+        if manifest.get("version") != BAKE_VERSION:
+            raise ValueError("Unsupported asset bake version: %r" % manifest.get("version"))
+
+        # Source files changed since the bake are stale; their images are loaded from the sources instead
+        self.stale = set(path for path, source in manifest["sources"].items() if not BakedAssets.source_matches(path, source))
+
+        # File and area holding each up-to-date baked image, keyed by (path, size)
+        self.images = {}
+        for entry in manifest["images"]:
+            if entry["path"] not in self.stale:
+                self.images[(entry["path"], tuple(entry["size"]))] = (entry["file"], pygame.Rect(entry["rect"]))
+
+    @staticmethod
+    def source_record(path):
+        # Describe a source file by its size, modification time and content hash
+        stat = os.stat(path)
+        return {"bytes": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha1": file_digest(path)}
+
+    @staticmethod
+    def source_matches(path, record):
+        # Compare a source file with its record, hashing it only when its size or modification time changed
+        try:
+            stat = os.stat(path)
+            if stat.st_size == record["bytes"] and stat.st_mtime_ns == record["mtime_ns"]:
+                return True
+            return file_digest(path) == record["sha1"]
+        except OSError:
+            return False
+
+    def lookup(self, image_path, size):
+        # Get the baked file and area of an image at a size, or None if it was not baked (or is stale)
+        return self.images.get((image_path, size))
+
+    def file_path(self, file):
+        # Get the path of a baked file
+        return os.path.join(self.directory, file)
+
+
+class AssetCache:
+    def __init__(self, bake_directory=BAKE_DIRECTORY):
+        # Decoded source images, keyed by file path, so each file is decoded only once
+        self.sources = {}
+
+        # Ready-to-blit surfaces, keyed by (path, target size, pixel format)
+        self.surfaces = {}
+
+        # Offline bake of pre-scaled images, opened on first use (None when there is no usable bake)
+        self.bake_directory = bake_directory
+        self.bake = None
+        self.bake_opened = False
+
+        # Decoded baked files, keyed by (file, pixel format)
+        self.sheets = {}
+
+        # Counters to check how often a request is served from the cache, and how often from the bake
+        self.hits = 0
+        self.misses = 0
+        self.baked = 0
+
+    def open_bake(self):
+        # Read the bake manifest once, falling back to the source files when there is no bake or it cannot be read
+        if not self.bake_opened:
+            self.bake_opened = True
+            if self.bake_directory is not None and os.path.exists(os.path.join(self.bake_directory, "manifest.json")):
+                try:
+                    self.bake = BakedAssets(self.bake_directory)
+                except (OSError, ValueError, KeyError, TypeError):
+                    self.bake = None
+        return self.bake
+
+    def sheet(self, file, pixel_format):
+        # Get a baked file decoded and converted to a pixel format, decoding it only once
+        sheet = self.sheets.get((file, pixel_format))
+        if sheet is None:
+            decoded = self.sheets.get((file, None))
+            if decoded is None:
+                decoded = pygame.image.load(self.bake.file_path(file))
+                self.sheets[(file, None)] = decoded
+            if pixel_format == "alpha":
+                sheet = decoded.convert_alpha()
+            elif pixel_format == "opaque":
+                sheet = decoded.convert()
+            else:
+                sheet = decoded
+            self.sheets[(file, pixel_format)] = sheet
+        return sheet
+
+    def install_sheet(self, file, decoded):
+        # Store a baked file decoded elsewhere (e.g. by the preloader), unless the cache already has it
+        self.sheets.setdefault((file, None), decoded)
+
+    def load_image(self, image_path, size=None, pixel_format="alpha"):
+        # Build the key identifying the shared surface
+        key = (image_path, tuple(size) if size is not None else None, pixel_format)
+
+        # Hand out the shared surface if it has already been prepared
+        surface = self.surfaces.get(key)
+        if surface is not None:
+            self.hits += 1
+            return surface
+        self.misses += 1
+
+        # Cut the surface out of its baked file if the bake has the image at this size
+        bake = self.open_bake() if size is not None else None
+        baked = bake.lookup(image_path, key[1]) if bake is not None else None
+        if baked is not None:
+            file, rect = baked
+            surface = self.sheet(file, pixel_format).subsurface(rect)
+            self.baked += 1
+            self.surfaces[key] = surface
+            return surface
+
+        # Decode the source file if no other size or format has needed it yet
+        source = self.sources.get(image_path)
+        if source is None:
+            source = pygame.image.load(image_path)
+            self.sources[image_path] = source
+
+        # Convert the image to the requested pixel format ("alpha", "opaque" or None to keep it as decoded)
+        if pixel_format == "alpha":
+            surface = source.convert_alpha()
+        elif pixel_format == "opaque":
+            surface = source.convert()
+        else:
+            surface = source
+
+        # Scale the image to the target size if one was given
+        if size is not None:
+            surface = pygame.transform.scale(surface, key[1])
+
+        # Store the surface so every later request shares it
+        self.surfaces[key] = surface
+        return surface
+
+    def install(self, image_path, size, pixel_format, surface, source=None):
+        # Store a surface prepared elsewhere (e.g. by the preloader), unless the cache already has one
+        key = (image_path, tuple(size) if size is not None else None, pixel_format)
+        self.surfaces.setdefault(key, surface)
+        if source is not None:
+            self.sources.setdefault(image_path, source)
+
+    def evict(self, image_path=None):
+        # Drop every cached surface (and the decoded source) of one file, or of all files if no path is given
+        if image_path is None:
+            self.surfaces.clear()
+            self.sources.clear()
+            self.sheets.clear()
+            return
+        for key in [key for key in self.surfaces if key[0] == image_path]:
+            del self.surfaces[key]
+        self.sources.pop(image_path, None)
+
+    def stats(self):
+        # Report the cache counters and the number of stored surfaces
+        return {"hits": self.hits, "misses": self.misses, "baked": self.baked, "surfaces": len(self.surfaces), "sources": len(self.sources), "sheets": len(self.sheets)}
+
+
+# Shared image cache used by every sprite
+ASSETS = AssetCache()
+
+
+class SilentSound:
+    # Stand-in for a pygame Sound when the game runs without audio
+    def play(self, loops=0, maxtime=0, fade_ms=0):
+        return None
+
+    def stop(self):
+        pass
+
+    def set_volume(self, volume):
+        pass
+
+    def get_length(self):
+        return 0.0
+
+
+class SoundBank:
+    def __init__(self):
+        # Without audio every sound effect is the same silent stand-in and no music plays
+        self.silent = False
+        self.silent_sound = SilentSound()
+
+        # Decoded sound effects, keyed by file path, so each file is decoded only once
+        self.sounds = {}
+
+        # Size of the decoded PCM buffer of each sound effect, keyed by file path
+        self.sizes = {}
+
+        # File path of each decoded sound effect, so the voice manager can look up its settings
+        self.paths = {}
+
+        # Path of the music track currently streamed from disk
+        self.music_path = None
+
+    def load_sound(self, sound_path, volume=None):
+        # Nothing is decoded without audio
+        if self.silent:
+            return self.silent_sound
+
+        # Decode the sound effect the first time it is requested
+        sound = self.sounds.get(sound_path)
+        if sound is None:
+            sound = self.install(sound_path, pygame.mixer.Sound(sound_path))
+
+        # Set the volume on the shared sound if one was given
+        if volume is not None:
+            sound.set_volume(volume)
+        return sound
+
+    def install(self, sound_path, sound):
+        # Store a decoded sound effect, unless the bank already has one for the path
+        if sound_path in self.sounds:
+            return self.sounds[sound_path]
+        self.sounds[sound_path] = sound
+        self.paths[sound] = sound_path
+
+        # Work out how many bytes the decoded samples take (frequency * bytes per sample * channels * seconds)
+        frequency, sample_format, channels = pygame.mixer.get_init()
+        self.sizes[sound_path] = int(sound.get_length() * frequency) * (abs(sample_format) // 8) * channels
+        return sound
+
+    def decoded_bytes(self):
+        # Total size of the PCM buffers held by the bank
+        return sum(self.sizes.values())
+
+    def play_music(self, music_path, volume=1.0, loops=-1):
+        # Stream the track from disk instead of decoding it fully into memory
+        if self.silent:
+            return
+        if self.music_path != music_path:
+            pygame.mixer.music.load(music_path)
+            self.music_path = music_path
+        pygame.mixer.music.set_volume(volume)
+        pygame.mixer.music.play(loops=loops)
+
+    def stop_music(self):
+        # Stop the streamed music track
+        if not self.silent:
+            pygame.mixer.music.stop()
+
+    def evict(self, sound_path=None):
+        # Drop one decoded sound effect, or all of them if no path is given
+        if sound_path is None:
+            self.sounds.clear()
+            self.sizes.clear()
+            self.paths.clear()
+            return
+        self.paths.pop(self.sounds.pop(sound_path, None), None)
+        self.sizes.pop(sound_path, None)
+
+
+# Shared sound bank used by every game object
+SOUNDS = SoundBank()
+
+
+class VoiceManager:
+    def __init__(self, channel_count=VOICE_CHANNELS):
+        # Number of mixer channels the manager owns, opened the first time a sound plays
+        self.channel_count = channel_count
+        self.channels = []
+
+        # Sound playing on each busy channel, as (sound path, priority, start time)
+        self.voices = {}
+
+        # Time each sound was last started, to drop repeated triggers inside its window
+        self.last_played = {}
+
+        # Counters to check how many triggers were played, dropped, or took the channel of another sound
+        self.played = 0
+        self.dropped = 0
+        self.stolen = 0
+
+    def open(self):
+        # Take over a fixed set of mixer channels
+        if not self.channels:
+            pygame.mixer.set_num_channels(self.channel_count)
+            self.channels = [pygame.mixer.Channel(index) for index in range(self.channel_count)]
+        return self.channels
+
+    def play(self, sound, loops=0):
+        # Nothing plays without audio
+        if SOUNDS.silent or isinstance(sound, SilentSound):
+            return None
+        channels = self.open()
+        sound_path = SOUNDS.paths.get(sound)
+        priority, limit, window = SOUND_VOICES.get(sound_path, DEFAULT_VOICE)
+        now = time.perf_counter()
+
+        # Drop a trigger that repeats the sound within its window
+        last = self.last_played.get(sound_path)
+        if last is not None and now - last < window:
+            self.dropped += 1
+            return None
+
+        # Forget the voices that have finished
+        for index in [index for index in self.voices if not channels[index].get_busy()]:
+            del self.voices[index]
+
+        # Restart the oldest instance of the sound if it already plays as often as allowed
+        same = [index for index, voice in self.voices.items() if voice[0] == sound_path]
+        if len(same) >= limit:
+            index = min(same, key=lambda index: self.voices[index][2])
+        else:
+            # Otherwise use a free channel, or take the one of the oldest voice with the lowest priority not above this sound's
+            free = [index for index in range(len(channels)) if index not in self.voices]
+            if free:
+                index = free[0]
+            else:
+                candidates = [index for index, voice in self.voices.items() if voice[1] <= priority]
+                if not candidates:
+                    self.dropped += 1
+                    return None
+                index = min(candidates, key=lambda index: self.voices[index][1:])
+                self.stolen += 1
+
+        # Start the sound on the channel, replacing whatever played there
+        channel = channels[index]
+        channel.play(sound, loops)
+        self.voices[index] = (sound_path, priority, now)
+        self.last_played[sound_path] = now
+        self.played += 1
+        return channel
+
+    def stop(self, sound):
+        # Stop every instance of a sound
+        sound_path = SOUNDS.paths.get(sound)
+        for index in [index for index, voice in self.voices.items() if voice[0] == sound_path]:
+            self.channels[index].stop()
+            del self.voices[index]
+
+    def stats(self):
+        # Report the counters and the number of channels in use
+        return {"played": self.played, "dropped": self.dropped, "stolen": self.stolen, "busy": len(self.voices), "channels": len(self.channels)}
+
+
+# Shared voice manager every sound effect is played through
+VOICES = VoiceManager()
+
+
+class StartupTimer:
+    def __init__(self, module_start):
+        # Time at which the game module started loading, and the stages reached since then as (stage, time)
+        self.module_start = module_start
+        self.stages = []
+
+        # Whether the report is printed when the first game frame is shown
+        self.enabled = False
+
+    def mark(self, stage):
+        # Record the first time a stage is reached
+        if stage not in [name for name, at in self.stages]:
+            self.stages.append((stage, time.perf_counter()))
+
+    def process_age(self):
+        # Seconds since the process was launched, read from /proc where it is available
+        try:
+            with open("/proc/self/stat") as file:
+                start_ticks = int(file.read().rsplit(")", 1)[1].split()[19])
+            with open("/proc/uptime") as file:
+                uptime = float(file.read().split()[0])
+            return max(0.0, uptime - start_ticks / os.sysconf("SC_CLK_TCK"))
+        except (OSError, ValueError, IndexError, AttributeError):
+            return None
+
+    def report(self):
+        # Print the time from process launch to every stage (or from module load if the launch time is unknown)
+        age = self.process_age()
+        launch = self.module_start if age is None else time.perf_counter() - age
+        print("Cold start, measured from %s:" % ("module load" if age is None else "process launch"))
+        print("  %-20s %8.1f ms" % ("module load started", (self.module_start - launch) * 1000))
+        for stage, at in self.stages:
+            print("  %-20s %8.1f ms" % (stage, (at - launch) * 1000))
+
+
+# Cold-start timer of this process
+STARTUP = StartupTimer(MODULE_START)
+STARTUP.mark("modules imported")
+
+
+def init_display(headless=False, size=None):
+    # Open the display module once, with the dummy video driver when there is no screen, and read the screen size (or use the given one)
+    global SCREEN_WIDTH, SCREEN_HEIGHT
+
+    # Headless runs need no display or audio device, so the mixer opened later by init_audio uses the dummy audio driver too
+    if headless:
+        os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+        os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+    if pygame.display.get_init():
+        # Once the display is open, a given size still replaces the screen size, so the next screen is opened at that size
+        if size:
+            SCREEN_WIDTH, SCREEN_HEIGHT = size
+        return
+    pygame.display.init()
+    pygame.display.set_caption("Mighty Action Game")
+    info = pygame.display.Info()
+    SCREEN_WIDTH, SCREEN_HEIGHT = size or (info.current_w, info.current_h)
+    STARTUP.mark("display ready")
+
+
+def init_audio(silent=False):
+    # Open the mixer unless the game runs silent, falling back to silence when there is no sound device
+    SOUNDS.silent = silent
+    if not silent and not pygame.mixer.get_init():
+        try:
+            pygame.mixer.init()
+        except pygame.error:
+            SOUNDS.silent = True
+    STARTUP.mark("audio ready")
+    return not SOUNDS.silent
+
+
+def init_fonts():
+    # Open the font module once
+    if not pygame.font.get_init():
+        pygame.font.init()
+
+
+def sprite_images():
+    # Images whose size does not depend on the screen, as (path, size)
+    images = [("img_character_mighty.png", (BLOCK_SIZE * 2, BLOCK_SIZE * 2)), ("img_block_castle.png", (BLOCK_SIZE * 6, BLOCK_SIZE * 6)), ("img_banner_tv.png", (75, 75))]
+    for image_path in ["img_block_dirt.png", "img_block_grass.png", "img_block_brick.png", "img_block_question.png",
+                       "img_enemy_mushroom.png", "img_enemy_robot.png", "img_enemy_orc.png",
+                       "img_item_high_jump.png", "img_item_speed_up.png", "img_item_muscle_up.png", "img_item_iron_body.png", "img_item_recovery.png", "img_item_confusion.png"]:
+        images.append((image_path, (BLOCK_SIZE, BLOCK_SIZE)))
+    for factor, size, count in CLOUD_DEPTHS:
+        images.append(("img_block_cloud.png", (size, size)))
+    return images
+
+
+def screen_images(width, height):
+    # Images scaled to the screen, as (path, size, pixel format): the start background as decoded, the banners with per-pixel alpha
+    images = [("img_start_background.png", (width, height), None)]
+    for image_path in ["img_banner_game_over.png", "img_banner_game_clear.png"]:
+        images.append((image_path, (int(width * 0.8), int(height * 0.4)), "alpha"))
+    return images
+
+
+def game_assets():
+    # Images a game needs as (path, size), all converted with per-pixel alpha
+    images = sprite_images()
+    images += [(image_path, size) for image_path, size, pixel_format in screen_images(SCREEN_WIDTH, SCREEN_HEIGHT) if pixel_format == "alpha"]
+
+    # Sound effects a game needs (the background music is streamed, not decoded)
+    sounds = ["audio_jumping.mp3", "audio_break.mp3", "audio_game_over.mp3", "audio_winner.mp3", "audio_hitting.mp3", "audio_killing.mp3",
+              "audio_power_up.mp3", "audio_power_down.mp3", "audio_recovery.mp3", "audio_pause.mp3", "audio_continue.mp3", "audio_exit.mp3"]
+    return images, sounds
+
+
+class AssetPreloader:
+    def __init__(self, images, sounds, workers=4):
+        # Images in the asset bake come from its files, decoded once each; the others are grouped by source file, so every file is decoded once
+        bake = ASSETS.open_bake()
+        sheets = OrderedDict()
+        sizes = OrderedDict()
+        for image_path, size in images:
+            baked = bake.lookup(image_path, tuple(size)) if bake is not None else None
+            if baked is not None:
+                sheets[baked[0]] = bake.file_path(baked[0])
+            else:
+                sizes.setdefault(image_path, []).append(size)
+
+        # Decode and scale the files on worker threads (pygame releases the GIL while decoding)
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.jobs = [("sheet", file, self.executor.submit(pygame.image.load, path)) for file, path in sheets.items()]
+        self.jobs += [("image", image_path, self.executor.submit(self.decode_image, image_path, image_sizes)) for image_path, image_sizes in sizes.items()]
+        if not SOUNDS.silent:
+            self.jobs += [("sound", sound_path, self.executor.submit(pygame.mixer.Sound, sound_path)) for sound_path in sounds]
+        self.total = len(self.jobs)
+        self.installed = 0
+
+    def decode_image(self, image_path, sizes):
+        # Decode the file and scale it to every requested size (runs on a worker thread)
+        source = pygame.image.load(image_path)
+        return source, [(size, pygame.transform.scale(source, size)) for size in sizes]
+
+    def install(self, kind, path, result):
+        # Hand a finished file to the shared caches, converting images on the main thread where the display lives
+        if kind == "image":
+            source, scaled = result
+            for size, surface in scaled:
+                ASSETS.install(path, size, "alpha", surface.convert_alpha(), source)
+        elif kind == "sheet":
+            ASSETS.install_sheet(path, result)
+            ASSETS.sheet(path, "alpha")
+        else:
+            SOUNDS.install(path, result)
+        self.installed += 1
+
+    def poll(self):
+        # Install the files finished since the last call without waiting for the others
+        pending = []
+        for kind, path, future in self.jobs:
+            if future.done():
+                self.install(kind, path, future.result())
+            else:
+                pending.append((kind, path, future))
+        self.jobs = pending
+        return self.progress()
+
+    def finish(self):
+        # Wait for the remaining files and install them, so the game finds everything in the caches
+        for kind, path, future in self.jobs:
+            self.install(kind, path, future.result())
+        self.jobs = []
+        self.executor.shutdown(wait=False)
+
+    def progress(self):
+        # Fraction of the files installed so far
+        return self.installed / self.total if self.total else 1.0
+
+    def draw(self, screen, rect):
+        # Draw a progress bar while files are still loading
+        if self.installed < self.total:
+            pygame.draw.rect(screen, DARKER_GRAY, rect)
+            pygame.draw.rect(screen, LIGHT_GRAY, (rect[0], rect[1], int(rect[2] * self.progress()), rect[3]))
+            pygame.draw.rect(screen, BLACK, rect, 2)
+
+
+class TextCache:
+    def __init__(self, max_entries=256):
+        # Maximum number of rendered strings kept before the least recently used one is dropped
+        self.max_entries = max_entries
+
+        # Rendered text surfaces, keyed by (font, text, color, antialias), oldest first
+        self.surfaces = OrderedDict()
+
+        # Counters to check that text is not rasterized again every frame
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def render(self, font, text, color, antialias=True):
+        # Hand out the cached surface if this text has been rendered before
+        key = (font, text, tuple(color), antialias)
+        surface = self.surfaces.get(key)
+        if surface is not None:
+            self.hits += 1
+            self.surfaces.move_to_end(key)
+            return surface
+        self.misses += 1
+
+        # Render the text and drop the least recently used surface if the cache is full
+        surface = font.render(text, antialias, color)
+        self.surfaces[key] = surface
+        if len(self.surfaces) > self.max_entries:
+            self.surfaces.popitem(last=False)
+            self.evictions += 1
+        return surface
+
+    def stats(self):
+        # Report the cache counters and the number of stored surfaces
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions, "surfaces": len(self.surfaces)}
+
+
+class GlyphAtlas:
+    def __init__(self, font, color, characters="", antialias=True):
+        # Font, color and antialiasing the glyphs are rendered with
+        self.font = font
+        self.color = color
+        self.antialias = antialias
+
+        # Rendered glyph of each character
+        self.glyphs = {}
+        for character in characters:
+            self.glyphs[character] = font.render(character, antialias, color)
+
+        # Counters of glyphs taken from the atlas and glyphs that had to be rendered
+        self.hits = 0
+        self.misses = 0
+
+    def glyph(self, character):
+        # Get the glyph of a character, rendering it the first time it is needed
+        glyph = self.glyphs.get(character)
+        if glyph is None:
+            self.misses += 1
+            glyph = self.glyphs[character] = self.font.render(character, self.antialias, self.color)
+        else:
+            self.hits += 1
+        return glyph
+
+    def draw(self, screen, text, position):
+        # Draw the text glyph by glyph, so strings that change often never have to be rasterized
+        x, y = position
+        batch = []
+        for character in text:
+            glyph = self.glyph(character)
+            batch.append((glyph, (x, y)))
+            x += glyph.get_width()
+        screen.blits(batch, doreturn=False)
+
+        # Return the area covered by the text
+        return pygame.Rect(position[0], y, x - position[0], self.font.get_height())
+
+    def stats(self):
+        # Report the atlas counters and the number of glyphs
+        return {"hits": self.hits, "misses": self.misses, "glyphs": len(self.glyphs)}
+
+
+# Shared text cache used by buttons and menus
+TEXT_CACHE = TextCache()
+
 class Button:
     def __init__(self, rect, text, color, hover_color, click_color, text_color, font, border_radius, border_width):
         # Initialize the button's rectangle (position and size)
@@ -76,8 +765,8 @@ class Button:
         # Draw the border around the button
         pygame.draw.rect(screen, self.text_color, border_rect, width=self.border_width, border_radius=self.border_radius)
 
-        # Render the text onto a surface
-        text_surface = self.font.render(self.text, True, self.text_color)
+        # Get the rendered text surface (rendered once and then shared from the text cache)
+        text_surface = TEXT_CACHE.render(self.font, self.text, self.text_color)
 
         # Get the rectangle of the text surface and center it within the button rectangle
         text_rect = text_surface.get_rect(center=self.rect.center)
@@ -155,11 +844,90 @@ class HealthBar:
         pygame.draw.rect(screen, self.inner_foreground_color, filled_rect, border_radius=self.border_radius - 3)
 
 
+class KeyState:
+    def __init__(self, pressed=()):
+        # Keys held down, as pygame key constants
+        self.pressed = frozenset(pressed)
+
+    def __getitem__(self, key):
+        # Report whether a key is held down, like the sequence returned by pygame.key.get_pressed()
+        return key in self.pressed
+
+    @staticmethod
+    def from_mask(mask):
+        # Get the keys held down in an input mask
+        return KeyState(key for key, bit in INPUT_KEYS.items() if mask & bit)
+
+
+class InputRecording:
+    def __init__(self, settings, masks=()):
+        # Settings the recorded game was created with, and one input mask per frame
+        self.settings = settings
+        self.masks = bytearray(masks)
+
+    def record(self, mask):
+        # Add the input of one frame
+        self.masks.append(mask)
+
+    def runs(self):
+        # Compress the frames into runs of the same input mask
+        runs = []
+        for mask in self.masks:
+            if runs and runs[-1][0] == mask and runs[-1][1] < 0xFFFF:
+                runs[-1][1] += 1
+            else:
+                runs.append([mask, 1])
+        return runs
+
+    def save(self, path):
+        # Write the settings and the runs of input masks
+        settings = json.dumps(self.settings).encode("utf-8")
+        with open(path, "wb") as file:
+            file.write(INPUT_HEADER.pack(INPUT_MAGIC, INPUT_VERSION, len(settings)))
+            file.write(settings)
+            file.write(b"".join(INPUT_RUN.pack(mask, count) for mask, count in self.runs()))
+
+    @staticmethod
+    def load(path):
+        # Read a recording written by save
+        with open(path, "rb") as file:
+            data = file.read()
+        magic, version, size = INPUT_HEADER.unpack_from(data, 0)
+        if magic != INPUT_MAGIC:
+            raise ValueError(path + " is not an input recording")
+        if version != INPUT_VERSION:
+            raise ValueError("Unsupported input recording version %d in %s" % (version, path))
+        settings = json.loads(data[INPUT_HEADER.size:INPUT_HEADER.size + size].decode("utf-8"))
+        masks = bytearray()
+        for mask, count in INPUT_RUN.iter_unpack(data[INPUT_HEADER.size + size:]):
+            masks += bytes([mask]) * count
+        return InputRecording(settings, masks)
+
+    def replay(self, frame_callback=None, **options):
+        # Play the recorded game again headless on a screen of the recorded size (even if the display is already open at another size), as fast as possible
+        settings = dict(self.settings)
+        init_display(True, tuple(settings.pop("screen")))
+        options.setdefault("silent", True)
+        game = Game(headless=True, **settings, **options)
+
+        # Run every entry, counting (and calling back before) only the physics steps, not the menu actions
+        steps = 0
+        for mask in self.masks:
+            step = not mask & (INPUT_PAUSE | INPUT_CONTINUE | INPUT_EXIT)
+            if step:
+                if frame_callback is not None:
+                    frame_callback(game)
+                steps += 1
+            if game.step_input(mask) is not None:
+                break
+        return game, steps
+
+
 class Character(pygame.sprite.Sprite):
     def __init__(self, x, y, width, height):
         super().__init__()
-        # Load the character image and scale it to the specified width and height
-        self.image = pygame.transform.scale(pygame.image.load("img_character_mighty.png").convert_alpha(), (width, height))
+        # Load the character image scaled to the specified width and height
+        self.image = ASSETS.load_image("img_character_mighty.png", (width, height))
 
         # Get the rectangle representing the character's position and size
         self.rect = self.image.get_rect()
@@ -177,6 +945,10 @@ class Character(pygame.sprite.Sprite):
         self.on_ground = False
         self.jump_count = 0
         self.is_space_pressed = False
+
+        # Exact position, kept apart from the whole-pixel rectangle so the fractions of a step are not rounded away
+        self.pos_x = float(self.rect.x)
+        self.pos_y = float(self.rect.y)
         
         # Attributes related to health
         self.health = 1000
@@ -188,15 +960,26 @@ class Character(pygame.sprite.Sprite):
         self.health_bar = HealthBar(20, 20, 200, 30, self.max_health)
         
         # Sound effect for jumping
-        self.jumping_sound = pygame.mixer.Sound("audio_jumping.mp3")
-        self.jumping_sound.set_volume(0.25)
+        self.jumping_sound = SOUNDS.load_sound("audio_jumping.mp3", 0.25)
 
         # Flag to indicate game over condition
         self.is_game_over = False
 
+        # Keys fed in by the game instead of reading the keyboard (None reads the keyboard)
+        self.keys = None
+
+        # Share of a 60 Hz frame covered by one physics step
+        self.step_scale = 1.0
+
+        # Rectangle at the start of the current step, so collisions can be tested along the whole move
+        self.step_start = self.rect.copy()
+
     def update(self):
-        # Handle movement based on keyboard input
-        keys = pygame.key.get_pressed()
+        # Remember where the step started
+        self.step_start = self.rect.copy()
+
+        # Handle movement based on keyboard input, or on the keys fed in by the game
+        keys = self.keys if self.keys is not None else pygame.key.get_pressed()
         if keys[pygame.K_LEFT]:
             self.move_left()
         elif keys[pygame.K_RIGHT]:
@@ -210,16 +993,18 @@ class Character(pygame.sprite.Sprite):
             self.jump_count = 0
         if keys[pygame.K_UP] and not self.is_space_pressed:
             if self.on_ground and self.jump_count < 2:
-                self.jumping_sound.play()
+                VOICES.play(self.jumping_sound)
                 self.speed_y = self.jump_strength
                 self.on_ground = False
                 self.jump_count += 1
                 self.is_space_pressed = True
         if not keys[pygame.K_UP]:
             self.is_space_pressed = False
-        self.speed_y += self.gravity
-        self.rect.y += self.speed_y
-        self.rect.x += self.speed_x
+        self.speed_y += self.gravity * self.step_scale
+        self.pos_y += self.speed_y * self.step_scale
+        self.pos_x += self.speed_x * self.step_scale
+        self.rect.y = self.pos_y
+        self.rect.x = self.pos_x
 
         # Check if character has fallen off the screen
         if self.rect.y > SCREEN_HEIGHT:
@@ -237,13 +1022,6 @@ class Character(pygame.sprite.Sprite):
         # Stop horizontal movement
         self.speed_x = 0
 
-    def reset_effects(self):
-        # Reset all special effects and attributes
-        self.speed = 5
-        self.jump_strength = -15
-        self.immune_to_damage = False
-        self.jump_damage = 1
-
     def update_health(self, health_change):
         # Update character's health
         self.health += health_change
@@ -260,8 +1038,8 @@ class Character(pygame.sprite.Sprite):
 class Scale_Block(pygame.sprite.Sprite):
     def __init__(self, image_path, x, y, width, height):
         super().__init__()
-        # Load the image and scale it to the specified width and height
-        self.image = pygame.transform.scale(pygame.image.load(image_path).convert_alpha(), (width, height))
+        # Load the image scaled to the specified width and height
+        self.image = ASSETS.load_image(image_path, (width, height))
 
         # Get the rectangle representing the block's position and size
         self.rect = self.image.get_rect()
@@ -272,10 +1050,10 @@ class Scale_Block(pygame.sprite.Sprite):
 
 
 class Item(pygame.sprite.Sprite):
-    def __init__(self, image_path, x, y):
+    def __init__(self, image_path, x, y, duration=0):
         super().__init__()
-        # Load the image and scale it to the BLOCK_SIZE
-        self.image = pygame.transform.scale(pygame.image.load(image_path).convert_alpha(), (BLOCK_SIZE, BLOCK_SIZE))
+        # Load the image scaled to the BLOCK_SIZE
+        self.image = ASSETS.load_image(image_path, (BLOCK_SIZE, BLOCK_SIZE))
 
         # Get the rectangle representing the item's position and size
         self.rect = self.image.get_rect()
@@ -284,50 +1062,73 @@ class Item(pygame.sprite.Sprite):
         self.rect.x = x
         self.rect.y = y
 
+        # Number of 60 Hz frames the effect lasts (0 for effects that happen once)
+        self.duration = duration
+
+    def expire_effect(self, character):
+        # Effects that happen once have nothing to undo
+        pass
+
 
 class HighJumpItem(Item):
     def __init__(self, x, y):
-        # Call the constructor of the parent class (Item)
-        super().__init__("img_item_high_jump.png", x, y)
+        # Call the constructor of the parent class (Item), with an effect lasting 5 seconds
+        super().__init__("img_item_high_jump.png", x, y, 300)
 
     def apply_effect(self, character):
         # Apply the effect of the high jump item to the character
         # Increase the character's jump strength to achieve a higher jump
         character.jump_strength = -20
 
+    def expire_effect(self, character):
+        # Return the character's jump strength to normal
+        character.jump_strength = -15
+
 
 class SpeedUpItem(Item):
     def __init__(self, x, y):
-        # Call the constructor of the parent class (Item)
-        super().__init__("img_item_speed_up.png", x, y)
+        # Call the constructor of the parent class (Item), with an effect lasting 5 seconds
+        super().__init__("img_item_speed_up.png", x, y, 300)
 
     def apply_effect(self, character):
         # Apply the effect of the speed-up item to the character
         # Increase the character's speed
         character.speed = 7.5
 
+    def expire_effect(self, character):
+        # Return the character's speed to normal
+        character.speed = 5
+
 
 class MuscleUpItem(Item):
     def __init__(self, x, y):
-        # Call the constructor of the parent class (Item)
-        super().__init__("img_item_muscle_up.png", x, y)
+        # Call the constructor of the parent class (Item), with an effect lasting 5 seconds
+        super().__init__("img_item_muscle_up.png", x, y, 300)
 
     def apply_effect(self, character):
         # Apply the effect of the muscle-up item to the character
         # Increase the damage caused by the character's jump
         character.jump_damage = 10
 
+    def expire_effect(self, character):
+        # Return the damage caused by the character's jump to normal
+        character.jump_damage = 1
+
 
 class IronBodyItem(Item):
     def __init__(self, x, y):
-        # Call the constructor of the parent class (Item)
-        super().__init__("img_item_iron_body.png", x, y)
+        # Call the constructor of the parent class (Item), with an effect lasting 5 seconds
+        super().__init__("img_item_iron_body.png", x, y, 300)
 
     def apply_effect(self, character):
         # Apply the effect of the iron body item to the character
         # Make the character immune to damage
         character.immune_to_damage = True
 
+    def expire_effect(self, character):
+        # Make the character vulnerable again
+        character.immune_to_damage = False
+
 
 class RecoveryItem(Item):
     def __init__(self, x, y):
@@ -347,11 +1148,71 @@ class ConfusionItem(Item):
     def apply_effect(self, character):
         character.update_health(-200)
 
+
+class EffectScheduler:
+    def __init__(self):
+        # Simulation time in physics steps
+        self.tick = 0
+
+        # Heap of (expiry tick, sequence number, effect key); entries replaced by a later expiry are skipped when they come up
+        self.heap = []
+        self.sequence = 0
+
+        # Expiry tick and (expire handler, target) of each running effect, keyed by effect (e.g. the item type)
+        self.expiries = {}
+        self.handlers = {}
+
+        # Tick the last running effect ends at (expiries only ever move later, so this is the maximum without scanning)
+        self.last_expiry = 0
+
+    def start(self, key, duration, apply, expire, target):
+        # Apply an effect to the target until duration ticks have passed; starting one that is already running applies it again and pushes its expiry back
+        apply(target)
+        expiry = max(self.tick + duration, self.expiries.get(key, 0))
+        self.expiries[key] = expiry
+        self.handlers[key] = (expire, target)
+        heapq.heappush(self.heap, (expiry, self.sequence, key))
+        self.sequence += 1
+        self.last_expiry = max(self.last_expiry, expiry)
+
+    def advance(self, ticks=1):
+        # Move simulation time on and end the effects whose expiry tick has passed, touching only the heap entries that are due
+        self.tick += ticks
+        while self.heap and self.heap[0][0] < self.tick:
+            expiry, sequence, key = heapq.heappop(self.heap)
+            if self.expiries.get(key) == expiry:
+                del self.expiries[key]
+                expire, target = self.handlers.pop(key)
+                expire(target)
+
+    def active(self, key):
+        # Whether an effect is running
+        return key in self.expiries
+
+    def __len__(self):
+        # Number of running effects
+        return len(self.expiries)
+
+    def remaining(self, key=None):
+        # Ticks left until an effect ends, or until the last running effect ends if no key is given (0 when nothing runs)
+        expiry = self.last_expiry if key is None else self.expiries.get(key, self.tick)
+        return max(0, expiry - self.tick)
+
+    def clear(self):
+        # End every running effect now
+        for key, (expire, target) in list(self.handlers.items()):
+            expire(target)
+        self.heap = []
+        self.expiries.clear()
+        self.handlers.clear()
+        self.last_expiry = self.tick
+
+
 class Question_Block(pygame.sprite.Sprite):
     def __init__(self, x, y):
         super().__init__()
-        # Load the image and scale it to the BLOCK_SIZE
-        self.image = pygame.transform.scale(pygame.image.load("img_block_question.png").convert_alpha(), (BLOCK_SIZE, BLOCK_SIZE))
+        # Load the image scaled to the BLOCK_SIZE
+        self.image = ASSETS.load_image("img_block_question.png", (BLOCK_SIZE, BLOCK_SIZE))
 
         # Get the rectangle representing the block's position and size
         self.rect = self.image.get_rect()
@@ -364,9 +1225,9 @@ class Question_Block(pygame.sprite.Sprite):
         self.is_hit = False  # Indicates whether the block has been hit
         
         # Sound effect for when the block is hit
-        self.breaking_sound = pygame.mixer.Sound("audio_break.mp3")
+        self.breaking_sound = SOUNDS.load_sound("audio_break.mp3")
 
-    def hit(self):
+    def hit(self, rng=random):
         # Check if the block has not been hit yet
         if not self.is_hit:
 
@@ -381,7 +1242,7 @@ class Question_Block(pygame.sprite.Sprite):
             ]
 
             # Randomly select an item class from the list
-            random_item_class = random.choice(items)
+            random_item_class = rng.choice(items)
 
             # Create an instance of the selected item class at the block's position
             item = random_item_class(self.rect.x, self.rect.y)
@@ -390,15 +1251,11 @@ class Question_Block(pygame.sprite.Sprite):
             self.is_hit = True  # Mark the block as hit
 
             # Play the breaking sound effect
-            self.breaking_sound.play()
+            VOICES.play(self.breaking_sound)
 
             # Remove the block sprite from the sprite group
             self.kill()  # Remove the block from the sprite group
 
-            # If the spawned item is a power-up item, set the game's timer check flag to True
-            if random_item_class in [HighJumpItem, SpeedUpItem, MuscleUpItem, IronBodyItem]:
-                game.timer_check = True
-
             # Return the spawned item
             return item
         
@@ -409,8 +1266,8 @@ class Question_Block(pygame.sprite.Sprite):
 class Enemy(pygame.sprite.Sprite):
     def __init__(self, image_path, x, y, movement_range, max_health, speed):
         super().__init__()
-        # Load the image and scale it to the BLOCK_SIZE
-        self.image = pygame.transform.scale(pygame.image.load(image_path).convert_alpha(), (BLOCK_SIZE, BLOCK_SIZE))
+        # Load the image scaled to the BLOCK_SIZE
+        self.image = ASSETS.load_image(image_path, (BLOCK_SIZE, BLOCK_SIZE))
 
         # Get the rectangle representing the enemy's position and size
         self.rect = self.image.get_rect()
@@ -425,6 +1282,9 @@ class Enemy(pygame.sprite.Sprite):
         # Define the movement range of the enemy
         self.movement_range = movement_range
 
+        # Exact horizontal position, kept apart from the whole-pixel rectangle so the fractions of a step are not rounded away
+        self.pos_x = float(x)
+
         # Set the speed of the enemy
         self.speed_x = speed * 2
 
@@ -437,6 +1297,9 @@ class Enemy(pygame.sprite.Sprite):
         # Set the initial movement direction of the enemy (1: right, -1: left)
         self.direction = 1
 
+        # Share of a 60 Hz frame covered by one physics step
+        self.step_scale = 1.0
+
         # Define a damage multiplier for the enemy's attacks
         self.damage_multiplier = 0.1
 
@@ -451,23 +1314,1074 @@ class Enemy(pygame.sprite.Sprite):
         if self.current_health <= 0:
             self.kill()
 
+    def patrol_bounds(self):
+        # Get the area the enemy can ever be in: its movement range, plus the one step it may overshoot at either edge
+        step = int(self.speed_x * self.step_scale) + 1
+        return pygame.Rect(self.initial_x - self.movement_range - step, self.rect.top, self.movement_range + 2 * step + self.rect.width, self.rect.height)
+
     def update(self):
         # Move the enemy horizontally according to its speed and direction
-        self.rect.x += self.speed_x * self.direction
+        self.pos_x += self.speed_x * self.direction * self.step_scale
+        self.rect.x = self.pos_x
         
         # Check if the enemy has reached the edge of its movement range
-        if self.rect.x <= self.initial_x - self.movement_range:
+        if self.pos_x <= self.initial_x - self.movement_range:
             # Change the direction to move right if reached left edge
             self.direction = 1
-        elif self.rect.x >= self.initial_x:
+        elif self.pos_x >= self.initial_x:
             # Change the direction to move left if reached right edge
             self.direction = -1
 
 
+class EnemyStore:
+    def __init__(self, capacity=64):
+        # Number of slots in use (dead enemies keep their slot until it is removed)
+        self.count = 0
+
+        # Size of every enemy
+        self.width = BLOCK_SIZE
+        self.height = BLOCK_SIZE
+
+        # One array per enemy attribute (struct of arrays), grown when full; x is the whole-pixel position and pos_x the exact one
+        self.x = np.zeros(capacity)
+        self.pos_x = np.zeros(capacity)
+        self.y = np.zeros(capacity)
+        self.speed_x = np.zeros(capacity)
+        self.direction = np.ones(capacity)
+        self.initial_x = np.zeros(capacity)
+        self.movement_range = np.zeros(capacity)
+        self.current_health = np.zeros(capacity, dtype=np.int64)
+        self.max_health = np.zeros(capacity, dtype=np.int64)
+        self.alive = np.zeros(capacity, dtype=bool)
+        self.has_hit_character = np.zeros(capacity, dtype=bool)
+
+        # Image of each enemy
+        self.images = []
+
+        # Slots of removed enemies that can be reused
+        self.free = []
+
+    def grow(self):
+        # Double the size of every array
+        for name in ("x", "pos_x", "y", "speed_x", "direction", "initial_x", "movement_range", "current_health", "max_health", "alive", "has_hit_character"):
+            array = getattr(self, name)
+            setattr(self, name, np.concatenate([array, np.zeros_like(array)]))
+
+    def add(self, image_path, x, y, movement_range, max_health, speed):
+        # Reuse the slot of a removed enemy, or make room for the new enemy
+        if self.free:
+            index = self.free.pop()
+        else:
+            if self.count == len(self.x):
+                self.grow()
+            index = self.count
+            self.count += 1
+            self.images.append(None)
+
+        # Store the enemy with the same attributes an Enemy sprite starts with
+        self.x[index] = x
+        self.pos_x[index] = x
+        self.y[index] = y
+        self.initial_x[index] = x
+        self.movement_range[index] = movement_range
+        self.speed_x[index] = speed * 2
+        self.max_health[index] = max_health
+        self.current_health[index] = max_health
+        self.direction[index] = 1
+        self.alive[index] = True
+        self.has_hit_character[index] = False
+        self.images[index] = ASSETS.load_image(image_path, (self.width, self.height))
+        return index
+
+    def remove(self, index):
+        # Take an enemy out of the game and free its slot for the next enemy
+        self.alive[index] = False
+        self.free.append(index)
+
+    def step(self, step_scale=1.0):
+        # Move every enemy at once, rounding the whole-pixel position half away from zero like assigning to Rect.x does
+        count = self.count
+        x = self.pos_x[:count] + self.speed_x[:count] * self.direction[:count] * step_scale
+        self.pos_x[:count] = x
+        self.x[:count] = np.where(x >= 0, np.floor(x + 0.5), np.ceil(x - 0.5))
+
+        # Turn around the enemies that reached an edge of their movement range
+        direction = self.direction[:count]
+        direction[x <= self.initial_x[:count] - self.movement_range[:count]] = 1
+        direction[x >= self.initial_x[:count]] = -1
+
+    def overlapping(self, rect):
+        # Get the living enemies overlapping a rectangle, in the order they were added
+        count = self.count
+        x = self.x[:count]
+        y = self.y[:count]
+        mask = self.alive[:count] & (x < rect.right) & (x + self.width > rect.left) & (y < rect.bottom) & (y + self.height > rect.top)
+        return np.flatnonzero(mask)
+
+    def visible(self, left, right):
+        # Get the living enemies overlapping a horizontal span
+        x = self.x[:self.count]
+        return np.flatnonzero(self.alive[:self.count] & (x < right) & (x + self.width > left))
+
+    def rect(self, index):
+        # Get the rectangle of one enemy
+        return pygame.Rect(int(self.x[index]), int(self.y[index]), self.width, self.height)
+
+    def take_damage(self, index, damage):
+        # Reduce the enemy's health and remove it from the game when it drops to or below zero
+        self.current_health[index] -= damage
+        if self.current_health[index] <= 0:
+            self.alive[index] = False
+
+    def __len__(self):
+        # Number of living enemies
+        return int(np.count_nonzero(self.alive[:self.count]))
+
+
+class StoredEnemy:
+    def __init__(self, store, index):
+        # Enemy in an EnemyStore, seen through the same attributes as an Enemy sprite
+        self.store = store
+        self.index = index
+        self.rect = store.rect(index)
+
+    @property
+    def current_health(self):
+        # Current health of the enemy, read from the store
+        return self.store.current_health[self.index].item()
+
+    @property
+    def has_hit_character(self):
+        # Whether the enemy has hit the character, read from the store
+        return self.store.has_hit_character[self.index].item()
+
+    def take_damage(self, damage):
+        # Reduce the enemy's health in the store
+        self.store.take_damage(self.index, damage)
+
+
+class CharacterBatch:
+    def __init__(self, blocks, count, x, y, width=BLOCK_SIZE * 2, height=BLOCK_SIZE * 2, step_scale=1.0, questions=()):
+        # Number of characters, their size, and the share of a 60 Hz frame covered by one step
+        self.count = count
+        self.width = width
+        self.height = height
+        self.step_scale = step_scale
+
+        # One array per Character attribute (struct of arrays), starting the way a Character does; x and y are the whole-pixel position and pos_x and pos_y the exact one
+        self.x = np.full(count, float(x))
+        self.y = np.full(count, float(y))
+        self.pos_x = self.x.copy()
+        self.pos_y = self.y.copy()
+        self.speed_x = np.zeros(count)
+        self.speed_y = np.zeros(count)
+        self.speed = np.full(count, 5.0)
+        self.gravity = np.full(count, 0.5)
+        self.jump_strength = np.full(count, -15.0)
+        self.on_ground = np.zeros(count, dtype=bool)
+        self.jump_count = np.zeros(count, dtype=np.int64)
+        self.is_space_pressed = np.zeros(count, dtype=bool)
+        self.is_game_over = np.zeros(count, dtype=bool)
+
+        # Edges of the solid blocks shared by every character, in the order they were added to the level
+        self.left = np.array([rect.left for rect in blocks], dtype=np.int64)
+        self.top = np.array([rect.top for rect in blocks], dtype=np.int64)
+        self.right = np.array([rect.right for rect in blocks], dtype=np.int64)
+        self.bottom = np.array([rect.bottom for rect in blocks], dtype=np.int64)
+
+        # Column of each question block (the indices in questions) in the table of blocks each character has broken, -1 for the other blocks
+        # (the table keeps at least one column, so it can be indexed on a level without question blocks)
+        self.question = np.full(len(blocks), -1, dtype=np.int64)
+        self.question[np.asarray(questions, dtype=np.int64)] = np.arange(len(questions))
+        self.broken = np.zeros((count, max(1, len(questions))), dtype=bool)
+
+        # Dense table of the blocks overlapping each grid cell (-1 pads cells holding fewer blocks than the fullest one)
+        cells = {}
+        for index, rect in enumerate(blocks):
+            for column in range(rect.left // BLOCK_SIZE, (rect.right - 1) // BLOCK_SIZE + 1):
+                for row in range(rect.top // BLOCK_SIZE, (rect.bottom - 1) // BLOCK_SIZE + 1):
+                    cells.setdefault((column, row), []).append(index)
+        columns = [column for column, row in cells] or [0]
+        rows = [row for column, row in cells] or [0]
+        self.first_column = min(columns)
+        self.first_row = min(rows)
+        depth = max([len(cell) for cell in cells.values()] or [1])
+        self.cells = np.full((max(rows) - self.first_row + 1, max(columns) - self.first_column + 1, depth), -1, dtype=np.int64)
+        for (column, row), cell in cells.items():
+            self.cells[row - self.first_row, column - self.first_column, :len(cell)] = cell
+
+        # Offsets of the cells a character's rectangle can cover, relative to the cell of its top-left corner
+        self.cell_columns = np.arange((width - 1) // BLOCK_SIZE + 2)
+        self.cell_rows = np.arange((height - 1) // BLOCK_SIZE + 2)
+
+    @staticmethod
+    def from_game(game, count):
+        # Put count characters at the game character's start, on the solid blocks of every chunk of the game's level (not only the chunks streamed in so far),
+        # in the order a game loading the whole level adds them, with every question block still to be hit
+        level = game.level
+        if level.last_chunk is None:
+            raise ValueError("A character batch needs a level with an end, not an endless one")
+        entities = [entity for index in range(level.first_chunk, level.last_chunk + 1) for entity in level.chunk(index) if entity[0] in ("ground", "brick", "question")]
+        blocks = [pygame.Rect(entity[1], entity[2], BLOCK_SIZE, BLOCK_SIZE) for entity in entities]
+        questions = [index for index, entity in enumerate(entities) if entity[0] == "question"]
+        rect = game.character.rect
+        return CharacterBatch(blocks, count, rect.x, rect.y, rect.width, rect.height, game.step_scale, questions)
+
+    def rounded(self, values):
+        # Round half away from zero, like assigning a float to a Rect does
+        return np.where(values >= 0, np.floor(values + 0.5), np.ceil(values - 0.5))
+
+    def hits(self):
+        # Get the lowest and highest index of the blocks overlapping each character (-1 for none)
+        columns = (self.x // BLOCK_SIZE).astype(np.int64)[:, None] + self.cell_columns - self.first_column
+        rows = (self.y // BLOCK_SIZE).astype(np.int64)[:, None] + self.cell_rows - self.first_row
+        inside = ((rows >= 0) & (rows < self.cells.shape[0]))[:, :, None] & ((columns >= 0) & (columns < self.cells.shape[1]))[:, None, :]
+        candidates = self.cells[rows.clip(0, self.cells.shape[0] - 1)[:, :, None], columns.clip(0, self.cells.shape[1] - 1)[:, None, :]]
+        candidates = np.where(inside[:, :, :, None], candidates, -1).reshape(self.count, -1)
+
+        # Keep the candidates whose block overlaps the character, like Rect.colliderect, leaving out the question blocks the character already broke
+        blocks = candidates.clip(0)
+        x = self.x[:, None]
+        y = self.y[:, None]
+        overlap = (candidates >= 0) & (self.left[blocks] < x + self.width) & (self.right[blocks] > x) & (self.top[blocks] < y + self.height) & (self.bottom[blocks] > y)
+        question = self.question[blocks]
+        overlap &= ~((question >= 0) & self.broken[np.arange(self.count)[:, None], question.clip(0)])
+        first = np.where(overlap, candidates, len(self.left)).min(axis=1)
+        last = np.where(overlap, candidates, -1).max(axis=1)
+        return np.where(first < len(self.left), first, -1), last
+
+    def step(self, masks):
+        # Advance every character by one step, each with its own input mask (or one mask for all)
+        masks = np.broadcast_to(np.asarray(masks, dtype=np.int64), (self.count,))
+        left = (masks & INPUT_LEFT) != 0
+        right = (masks & INPUT_RIGHT) != 0
+        up = (masks & INPUT_UP) != 0
+
+        # Handle movement based on the keys, left winning over right like Character.update
+        self.speed_x = np.where(left, -self.speed, np.where(right, self.speed, 0.0))
+
+        # Stand still on the ground, then jump where the jump key was just pressed
+        self.speed_y[self.on_ground] = 0
+        self.jump_count[self.on_ground] = 0
+        jump = up & ~self.is_space_pressed & self.on_ground & (self.jump_count < 2)
+        self.speed_y[jump] = self.jump_strength[jump]
+        self.on_ground[jump] = False
+        self.jump_count[jump] += 1
+        self.is_space_pressed[jump] = True
+        self.is_space_pressed[~up] = False
+
+        # Apply gravity and update position, then flag the characters that fell off the screen
+        self.speed_y += self.gravity * self.step_scale
+        self.pos_y += self.speed_y * self.step_scale
+        self.pos_x += self.speed_x * self.step_scale
+        self.y = self.rounded(self.pos_y)
+        self.x = self.rounded(self.pos_x)
+        self.is_game_over |= self.y > SCREEN_HEIGHT
+
+        # Land on the first block overlapping a falling character, like the first hit in Game.check_collisions
+        first, last = self.hits()
+        landed = (first >= 0) & (self.speed_y > 0)
+        self.y[landed] = self.top[first[landed]] - self.height
+        self.pos_y[landed] = self.y[landed]
+        self.speed_y[landed] = 0
+        self.on_ground[landed] = True
+
+        # Break the question block a character landed on and bounce it up, like the item spawn in Game.check_collisions (the items themselves are not part of the batch)
+        question = self.question[first.clip(0)]
+        bounced = landed & (question >= 0)
+        self.broken[np.flatnonzero(bounced), question[bounced]] = True
+        self.speed_y[bounced] = self.jump_strength[bounced]
+        self.on_ground[bounced] = False
+        self.on_ground[first < 0] = False
+
+        # Push moving characters out of the blocks overlapping them after landing (the last hit wins, like the per-sprite loop)
+        first, last = self.hits()
+        pushed_left = (last >= 0) & (self.speed_x > 0)
+        self.x[pushed_left] = self.left[last[pushed_left]] - self.width
+        pushed_right = (last >= 0) & (self.speed_x < 0)
+        self.x[pushed_right] = self.right[last[pushed_right]]
+        self.pos_x[pushed_left | pushed_right] = self.x[pushed_left | pushed_right]
+
+    def rect(self, index):
+        # Get the rectangle of one character
+        return pygame.Rect(int(self.x[index]), int(self.y[index]), self.width, self.height)
+
+
+class TileGrid:
+    def __init__(self, cell_size):
+        # Size of one grid cell in pixels
+        self.cell_size = cell_size
+
+        # Sprites overlapping each occupied cell, keyed by (column, row) tile coordinates
+        self.cells = {}
+
+        # Insertion order of each sprite, so queries return hits in a stable order
+        self.order = {}
+        self.next_order = 0
+
+    def cell_range(self, rect):
+        # Get the columns and rows of the cells covered by a rectangle
+        columns = range(rect.left // self.cell_size, (rect.right - 1) // self.cell_size + 1)
+        rows = range(rect.top // self.cell_size, (rect.bottom - 1) // self.cell_size + 1)
+        return columns, rows
+
+    def add(self, sprite):
+        # Remember when the sprite was added
+        self.order[sprite] = self.next_order
+        self.next_order += 1
+
+        # Store the sprite in every cell its rectangle covers
+        columns, rows = self.cell_range(sprite.rect)
+        for column in columns:
+            for row in rows:
+                self.cells.setdefault((column, row), []).append(sprite)
+
+    def remove(self, sprite):
+        # Ignore sprites that are not in the grid
+        if self.order.pop(sprite, None) is None:
+            return
+
+        # Take the sprite out of every cell it was stored in
+        columns, rows = self.cell_range(sprite.rect)
+        for column in columns:
+            for row in rows:
+                cell = self.cells.get((column, row))
+                if cell and sprite in cell:
+                    cell.remove(sprite)
+                    if not cell:
+                        del self.cells[(column, row)]
+
+    def query(self, rect):
+        # Collect the sprites colliding with the rectangle, looking only at the cells under it
+        hits = set()
+        columns, rows = self.cell_range(rect)
+        for column in columns:
+            for row in rows:
+                cell = self.cells.get((column, row))
+                if cell:
+                    for sprite in cell:
+                        if sprite not in hits and rect.colliderect(sprite.rect):
+                            hits.add(sprite)
+
+        # Return the hits in the order the sprites were added, like spritecollide does for a group
+        return sorted(hits, key=self.order.__getitem__)
+
+
+def tunnelled(start, end, target):
+    # Whether a rectangle moving straight from start to end crossed target from one side to the other, overlapping it on the way
+    crossed_x = (start.right <= target.left and end.left >= target.right) or (start.left >= target.right and end.right <= target.left)
+    crossed_y = (start.bottom <= target.top and end.top >= target.bottom) or (start.top >= target.bottom and end.bottom <= target.top)
+    if not (crossed_x or crossed_y):
+        return False
+
+    # Find the part of the move during which the rectangle overlaps the target along each axis (slab test)
+    enter, leave = 0.0, 1.0
+    for position, size, move, low, high in ((start.left, start.width, end.left - start.left, target.left, target.right), (start.top, start.height, end.top - start.top, target.top, target.bottom)):
+        if move == 0:
+            if position + size <= low or position >= high:
+                return False
+        else:
+            first, last = (low - position - size) / move, (high - position) / move
+            enter = max(enter, min(first, last))
+            leave = min(leave, max(first, last))
+    return enter < leave
+
+
+class SweepAndPrune(pygame.sprite.Group):
+    def __init__(self):
+        # Sprites sorted by the left edge of their bounds (the area they can ever be in), and those left edges for bisecting
+        self.by_left = []
+        self.lefts = []
+
+        # Bounds of each sprite, and the widest bounds so a query knows how far to its left a sprite may start
+        self.bounds = {}
+        self.max_width = 0
+
+        # Insertion order of each sprite, so queries return hits in the order spritecollide would
+        self.order = {}
+        self.next_order = 0
+        super().__init__()
+
+    def add_internal(self, sprite, layer=None):
+        # Sort the sprite in by the left edge of its bounds: patrolling enemies by their patrol range, anything else by its rectangle
+        super().add_internal(sprite, layer)
+        bounds = sprite.patrol_bounds() if hasattr(sprite, "patrol_bounds") else sprite.rect.copy()
+        index = bisect.bisect_right(self.lefts, bounds.left)
+        self.by_left.insert(index, sprite)
+        self.lefts.insert(index, bounds.left)
+        self.bounds[sprite] = bounds
+        self.max_width = max(self.max_width, bounds.width)
+        self.order[sprite] = self.next_order
+        self.next_order += 1
+
+    def remove_internal(self, sprite):
+        # Take the sprite out of the sorted list
+        super().remove_internal(sprite)
+        bounds = self.bounds.pop(sprite)
+        del self.order[sprite]
+        index = bisect.bisect_left(self.lefts, bounds.left)
+        while self.by_left[index] is not sprite:
+            index += 1
+        del self.by_left[index]
+        del self.lefts[index]
+
+    def candidates(self, rect):
+        # Get the sprites whose bounds overlap the rectangle, looking only at the part of the sorted list near it
+        first = bisect.bisect_left(self.lefts, rect.left - self.max_width)
+        last = bisect.bisect_left(self.lefts, rect.right)
+        return [sprite for sprite in self.by_left[first:last] if self.bounds[sprite].colliderect(rect)]
+
+    def query(self, rect):
+        # Get the sprites colliding with the rectangle, in the order they were added
+        hits = [sprite for sprite in self.candidates(rect) if rect.colliderect(sprite.rect)]
+        hits.sort(key=self.order.__getitem__)
+        return hits
+
+    def sweep(self, start, end):
+        # Get the sprites colliding with a rectangle at the end of its move, or passed through on the way (moves too short to cross anything are tested at the end only)
+        if abs(end.left - start.left) <= end.width and abs(end.top - start.top) <= end.height:
+            return self.query(end)
+        hits = [sprite for sprite in self.candidates(start.union(end)) if end.colliderect(sprite.rect) or tunnelled(start, end, sprite.rect)]
+        hits.sort(key=self.order.__getitem__)
+        return hits
+
+    def pairs(self):
+        # Get every pair of colliding sprites in one sweep along the sorted bounds
+        pairs = []
+        active = []
+        for sprite in self.by_left:
+            bounds = self.bounds[sprite]
+            active = [other for other in active if self.bounds[other].right > bounds.left]
+            for other in active:
+                if sprite.rect.colliderect(other.rect):
+                    pairs.append((other, sprite))
+            active.append(sprite)
+        return pairs
+
+
+class RenderIndex:
+    def __init__(self, bucket_width):
+        # Width in pixels of one bucket along the x-axis
+        self.bucket_width = bucket_width
+
+        # Sprites overlapping each bucket, keyed by bucket number
+        self.buckets = {}
+
+        # Buckets each sprite is currently stored in
+        self.placement = {}
+
+        # Draw order of each sprite as (layer, number), so sprites are drawn layer by layer in the order they were added
+        self.order = {}
+        self.next_order = 0
+
+        # Sprites that move and have to be re-bucketed every frame
+        self.moving = set()
+
+    def bucket_range(self, left, right):
+        # Get the buckets covered by a horizontal span
+        return range(left // self.bucket_width, (right - 1) // self.bucket_width + 1)
+
+    def add(self, sprite, moving=False, layer=0):
+        # Remember the draw order of the sprite and store it in its buckets
+        self.order[sprite] = (layer, self.next_order)
+        self.next_order += 1
+        self.place(sprite)
+
+        # Keep track of sprites whose position changes
+        if moving:
+            self.moving.add(sprite)
+
+    def place(self, sprite):
+        # Store the sprite in every bucket its rectangle covers
+        buckets = self.bucket_range(sprite.rect.left, sprite.rect.right)
+        self.placement[sprite] = buckets
+        for bucket in buckets:
+            self.buckets.setdefault(bucket, set()).add(sprite)
+
+    def unplace(self, sprite):
+        # Take the sprite out of the buckets it was stored in
+        for bucket in self.placement.pop(sprite):
+            sprites = self.buckets[bucket]
+            sprites.discard(sprite)
+            if not sprites:
+                del self.buckets[bucket]
+
+    def remove(self, sprite):
+        # Forget a sprite that is no longer drawn
+        if self.order.pop(sprite, None) is not None:
+            self.unplace(sprite)
+            self.moving.discard(sprite)
+
+    def refresh(self):
+        # Move the moving sprites to new buckets if they crossed a bucket edge
+        for sprite in self.moving:
+            buckets = self.bucket_range(sprite.rect.left, sprite.rect.right)
+            if buckets != self.placement[sprite]:
+                self.unplace(sprite)
+                self.place(sprite)
+
+    def visible(self, left, right, top, bottom):
+        # Gather the sprites stored in the buckets overlapping the view
+        candidates = set()
+        for bucket in self.bucket_range(int(left) - 1, int(right) + 1):
+            sprites = self.buckets.get(bucket)
+            if sprites:
+                candidates.update(sprites)
+
+        # Keep the sprites that overlap the view, dropping the ones killed since the last frame
+        visible = []
+        dead = []
+        for sprite in candidates:
+            if not sprite.alive():
+                dead.append(sprite)
+            elif sprite.rect.right > left and sprite.rect.left < right and sprite.rect.bottom > top and sprite.rect.top < bottom:
+                visible.append(sprite)
+        for sprite in dead:
+            self.remove(sprite)
+
+        # Return the visible sprites in draw order
+        visible.sort(key=self.order.__getitem__)
+        return visible
+
+
+class TerrainLayer:
+    def __init__(self, chunk_width, background_color, keep_distance=2):
+        # Width in pixels of one pre-composited chunk
+        self.chunk_width = chunk_width
+
+        # Color behind the tiles, so chunks can be drawn without per-pixel alpha
+        self.background_color = background_color
+
+        # How many chunks beyond the visible ones are kept before their surfaces are thrown away
+        self.keep_distance = keep_distance
+
+        # Static tiles overlapping each chunk, keyed by chunk number
+        self.tiles = {}
+
+        # Baked chunk surfaces and their top y-coordinate, keyed by chunk number
+        self.surfaces = {}
+
+    def add(self, tile):
+        # Store the tile in every chunk it overlaps and throw away those chunks' stale surfaces
+        for chunk in range(tile.rect.left // self.chunk_width, (tile.rect.right - 1) // self.chunk_width + 1):
+            self.tiles.setdefault(chunk, []).append(tile)
+            self.surfaces.pop(chunk, None)
+
+    def remove(self, tile):
+        # Take the tile out of every chunk it overlaps and throw away those chunks' stale surfaces
+        for chunk in range(tile.rect.left // self.chunk_width, (tile.rect.right - 1) // self.chunk_width + 1):
+            tiles = self.tiles.get(chunk)
+            if tiles is not None and tile in tiles:
+                tiles.remove(tile)
+                if not tiles:
+                    del self.tiles[chunk]
+                self.surfaces.pop(chunk, None)
+
+    def bake(self, chunk):
+        # Get the vertical band covered by the chunk's tiles
+        tiles = self.tiles[chunk]
+        top = min(tile.rect.top for tile in tiles)
+        bottom = max(tile.rect.bottom for tile in tiles)
+
+        # Composite every tile of the chunk onto one opaque surface
+        surface = pygame.Surface((self.chunk_width, bottom - top)).convert()
+        surface.fill(self.background_color)
+        left = chunk * self.chunk_width
+        surface.blits([(tile.image, (tile.rect.x - left, tile.rect.y - top)) for tile in tiles], doreturn=False)
+
+        # Keep the baked surface until the camera moves far away from it
+        self.surfaces[chunk] = (surface, top)
+        return self.surfaces[chunk]
+
+    def draw(self, screen, camera_x):
+        # Get the chunks overlapping the camera window
+        first = int(camera_x // self.chunk_width)
+        last = int((camera_x + screen.get_width()) // self.chunk_width)
+
+        # Draw each visible chunk, baking it the first time it is needed
+        for chunk in range(first, last + 1):
+            if chunk in self.tiles:
+                surface, top = self.surfaces.get(chunk) or self.bake(chunk)
+                screen.blit(surface, (chunk * self.chunk_width - camera_x, top))
+
+        # Throw away the surfaces of chunks far away from the camera
+        for chunk in [chunk for chunk in self.surfaces if chunk < first - self.keep_distance or chunk > last + self.keep_distance]:
+            del self.surfaces[chunk]
+
+
+class ProceduralLevel:
+    def __init__(self, seed, length=LEVEL_LENGTH):
+        # Seed every chunk is generated from, so a chunk comes out the same each time it is loaded
+        self.seed = seed
+
+        # Column of the castle at the end of the level, or None for an endless level
+        self.length = length
+
+        # First and last chunk of the level (no last chunk for an endless level)
+        self.chunk_columns = CHUNK_COLUMNS
+        self.first_chunk = -6 // CHUNK_COLUMNS
+        self.last_chunk = None if length is None else (length + 100 - 1) // CHUNK_COLUMNS
+
+    def has_ground(self, column):
+        # The ground starts 6 blocks left of the start, has a 5 block wide pit every 50 blocks and ends 100 blocks past the castle
+        if column < -6 or (self.length is not None and column >= self.length + 100):
+            return False
+
+        # The last 45 blocks before the castle and everything past it are solid, so the castle stands on ground (an endless level keeps its pits)
+        if self.length is not None and column >= self.length - 45:
+            return True
+        return column < 50 or column % 50 >= 5
+
+    def obstacle_start(self, index):
+        # Column of the first obstacle of a chunk, from random numbers of its own, so the chunk before can work it out without generating this one
+        return index * CHUNK_COLUMNS + random.Random("%s:%d:start" % (self.seed, index)).randint(0, 4)
+
+    def obstacle_columns(self, index, rng):
+        # Walk 5 to 15 blocks at a time from the chunk's first obstacle, stopping at least 5 blocks before the next chunk's first one
+        column = self.obstacle_start(index)
+        end = self.obstacle_start(index + 1)
+        columns = [column]
+        while True:
+            step = rng.randint(5, 15)
+            if column + step > end - 5:
+                break
+            column += step
+            columns.append(column)
+
+        # Fill a gap of more than 15 blocks before the next chunk's first obstacle, so obstacles stay 5 to 15 blocks apart across the chunk boundary
+        if end - column > 15:
+            columns.append(column + rng.randint(5, end - column - 5))
+        return columns
+
+    def chunk(self, index):
+        # Give every chunk its own random numbers, so chunks can be generated in any order
+        rng = random.Random("%s:%d" % (self.seed, index))
+        first = index * CHUNK_COLUMNS
+        columns = range(first, first + CHUNK_COLUMNS)
+        entities = []
+
+        # Lay the bottom dirt, middle dirt and top grass layers of ground
+        for row, image_path in ((1, "img_block_dirt.png"), (2, "img_block_dirt.png"), (3, "img_block_grass.png")):
+            for column in columns:
+                if self.has_ground(column):
+                    entities.append(("ground", column * BLOCK_SIZE, SCREEN_HEIGHT - row * BLOCK_SIZE, image_path))
+
+        # Place question blocks and bricks 5 to 15 blocks apart at random heights, stopping 10 blocks before the castle
+        for column in self.obstacle_columns(index, rng):
+            if column >= 5 and (self.length is None or column <= self.length - 10):
+                kind = "question" if rng.randint(1, 2) == 2 else "brick"
+                entities.append((kind, column * BLOCK_SIZE, rng.randint(SCREEN_HEIGHT//2, SCREEN_HEIGHT - 5 * BLOCK_SIZE)))
+
+        # Place an enemy of a random type every 17 blocks, stopping 25 blocks before the castle
+        enemy_types = [
+            ("img_enemy_mushroom.png", 1),
+            ("img_enemy_robot.png", 2),
+            ("img_enemy_orc.png", 3)
+        ]
+        for column in columns:
+            if column >= 9 and (column - 9) % 17 == 0 and (self.length is None or column < self.length - 25):
+                image_path, number = rng.choice(enemy_types)
+                entities.append(("enemy", column * BLOCK_SIZE, SCREEN_HEIGHT - 4 * BLOCK_SIZE, image_path, 100 * number, number, number * 0.75))
+
+        # Place the castle at the end of the level
+        if self.length is not None and self.length in columns:
+            entities.append(("castle", self.length * BLOCK_SIZE, SCREEN_HEIGHT - 9 * BLOCK_SIZE))
+        return entities
+
+
+class LevelFile:
+    def __init__(self, path):
+        # Map the file into memory, so only the chunks that are loaded are ever read
+        self.path = path
+        with open(path, "rb") as file:
+            self.data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        # Read the header and check that the file is a level this version of the game understands
+        magic, version, self.seed, length, self.first_chunk, chunk_count, self.chunk_columns, block_size, self.rows = LEVEL_HEADER.unpack_from(self.data, 0)
+        if magic != LEVEL_MAGIC:
+            raise ValueError(path + " is not a level file")
+        if version != LEVEL_VERSION:
+            raise ValueError("Unsupported level file version %d in %s" % (version, path))
+        if block_size != BLOCK_SIZE:
+            raise ValueError("Level file %s uses %d pixel blocks instead of %d" % (path, block_size, BLOCK_SIZE))
+        self.length = length
+        self.last_chunk = self.first_chunk + chunk_count - 1
+
+        # Read the table of image paths the tiles and entities refer to
+        offset = LEVEL_HEADER.size
+        (image_count,) = struct.unpack_from("<H", self.data, offset)
+        offset += 2
+        self.images = []
+        for _ in range(image_count):
+            (size,) = struct.unpack_from("<H", self.data, offset)
+            self.images.append(self.data[offset + 2:offset + 2 + size].decode("utf-8"))
+            offset += 2 + size
+
+        # Remember where the chunk index starts
+        self.index_offset = offset
+
+    def chunk_entry(self, index):
+        # Get the offset and number of entities of a chunk from the chunk index
+        return LEVEL_INDEX_ENTRY.unpack_from(self.data, self.index_offset + (index - self.first_chunk) * LEVEL_INDEX_ENTRY.size)
+
+    def has_ground(self, column):
+        # Check the tile grid for ground in a column
+        index = column // self.chunk_columns
+        if index < self.first_chunk or index > self.last_chunk:
+            return False
+        offset = self.chunk_entry(index)[0] + column - index * self.chunk_columns
+        return any(self.data[offset + row * self.chunk_columns] for row in range(self.rows))
+
+    def chunk(self, index):
+        # Get the entities of one chunk in the same form as a procedural level
+        offset, entity_count = self.chunk_entry(index)
+        first = index * self.chunk_columns
+        entities = []
+
+        # Turn the tile grid into ground tiles, bottom row first (tile 0 is empty, others are 1 + image number)
+        for row in range(self.rows):
+            tiles = self.data[offset + row * self.chunk_columns:offset + (row + 1) * self.chunk_columns]
+            for column, tile in enumerate(tiles):
+                if tile:
+                    entities.append(("ground", (first + column) * BLOCK_SIZE, SCREEN_HEIGHT - (row + 1) * BLOCK_SIZE, self.images[tile - 1]))
+        offset += self.rows * self.chunk_columns
+
+        # Read the entity table
+        for kind, image, x, height, movement_range, max_health, speed in LEVEL_ENTITY.iter_unpack(self.data[offset:offset + entity_count * LEVEL_ENTITY.size]):
+            kind = LEVEL_ENTITY_KINDS[kind]
+            if kind == "enemy":
+                entities.append((kind, x, SCREEN_HEIGHT - height, self.images[image], movement_range, max_health, speed))
+            else:
+                entities.append((kind, x, SCREEN_HEIGHT - height))
+        return entities
+
+    def close(self):
+        # Unmap the file
+        self.data.close()
+
+    @staticmethod
+    def save(level, path):
+        # Levels without an end cannot be written out
+        if level.last_chunk is None:
+            raise ValueError("An endless level cannot be saved")
+        chunks = [level.chunk(index) for index in range(level.first_chunk, level.last_chunk + 1)]
+
+        # Number every image path, and find out how many rows of ground the tile grid needs
+        images = []
+        rows = 0
+        for entities in chunks:
+            for entity in entities:
+                if entity[0] == "ground":
+                    rows = max(rows, (SCREEN_HEIGHT - entity[2]) // BLOCK_SIZE)
+                    if entity[3] not in images:
+                        images.append(entity[3])
+                elif entity[0] == "enemy" and entity[3] not in images:
+                    images.append(entity[3])
+
+        # Encode every chunk as its tile grid followed by its entity table
+        encoded = []
+        for index, entities in enumerate(chunks):
+            first = (level.first_chunk + index) * level.chunk_columns
+            grid = bytearray(rows * level.chunk_columns)
+            table = []
+            for entity in entities:
+                kind, x, y = entity[:3]
+                if kind == "ground":
+                    grid[((SCREEN_HEIGHT - y) // BLOCK_SIZE - 1) * level.chunk_columns + x // BLOCK_SIZE - first] = images.index(entity[3]) + 1
+                elif kind == "enemy":
+                    table.append(LEVEL_ENTITY.pack(LEVEL_ENTITY_KINDS.index(kind), images.index(entity[3]), x, SCREEN_HEIGHT - y, *entity[4:]))
+                else:
+                    table.append(LEVEL_ENTITY.pack(LEVEL_ENTITY_KINDS.index(kind), 0, x, SCREEN_HEIGHT - y, 0, 0, 0))
+            encoded.append((bytes(grid) + b"".join(table), len(table)))
+
+        # Write the header and image paths, then the chunk index and the chunks
+        header = LEVEL_HEADER.pack(LEVEL_MAGIC, LEVEL_VERSION, level.seed, level.length, level.first_chunk, len(chunks), level.chunk_columns, BLOCK_SIZE, rows)
+        header += struct.pack("<H", len(images))
+        for image in images:
+            header += struct.pack("<H", len(image.encode("utf-8"))) + image.encode("utf-8")
+        offset = len(header) + len(chunks) * LEVEL_INDEX_ENTRY.size
+        with open(path, "wb") as file:
+            file.write(header)
+            for data, entity_count in encoded:
+                file.write(LEVEL_INDEX_ENTRY.pack(offset, entity_count))
+                offset += len(data)
+            for data, entity_count in encoded:
+                file.write(data)
+
+
+class LevelStreamer:
+    def __init__(self, level, spawn, despawn, view_width, look_ahead=2, keep_behind=2, loads_per_frame=1):
+        # Level the chunks come from, and the functions that put an entity into the game and take it out again
+        self.level = level
+        self.spawn = spawn
+        self.despawn = despawn
+
+        # Width in pixels of one chunk and of the camera window
+        self.chunk_width = level.chunk_columns * BLOCK_SIZE
+        self.view_width = view_width
+
+        # How many chunks are loaded ahead of the screen, how far behind it chunks are kept, and how many are loaded per frame
+        self.look_ahead = look_ahead
+        self.keep_behind = keep_behind
+        self.loads_per_frame = loads_per_frame
+
+        # Loaded chunks as lists of (entity number, entity, handle), keyed by chunk number
+        self.loaded = {}
+
+        # Numbers of the entities used up in each chunk (hit question blocks, defeated enemies), so they never come back
+        self.consumed = {}
+
+    def in_level(self, chunk):
+        # Check that a chunk is part of the level
+        return chunk >= self.level.first_chunk and (self.level.last_chunk is None or chunk <= self.level.last_chunk)
+
+    def update(self, camera_x, budget=None):
+        # Get the chunks overlapping the camera window
+        first = int(camera_x // self.chunk_width)
+        last = int((camera_x + self.view_width) // self.chunk_width)
+
+        # Load the visible chunks right away, then the ones ahead and the one behind, a few per frame
+        if budget is None:
+            budget = self.loads_per_frame
+        visible = range(first, last + 1)
+        for chunk in list(visible) + list(range(last + 1, last + self.look_ahead + 1)) + [first - 1]:
+            if chunk in self.loaded or not self.in_level(chunk):
+                continue
+            if chunk not in visible:
+                if budget <= 0:
+                    break
+                budget -= 1
+            self.load(chunk)
+
+        # Unload the chunks that are far away from the camera
+        for chunk in [chunk for chunk in self.loaded if chunk < first - self.keep_behind or chunk > last + self.look_ahead + self.keep_behind]:
+            self.unload(chunk)
+
+    def load_all(self):
+        # Load every chunk of a level with an end
+        for chunk in range(self.level.first_chunk, self.level.last_chunk + 1):
+            if chunk not in self.loaded:
+                self.load(chunk)
+
+    def load(self, chunk):
+        # Put every entity of the chunk that has not been used up into the game
+        consumed = self.consumed.get(chunk, ())
+        self.loaded[chunk] = [(number, entity, self.spawn(entity)) for number, entity in enumerate(self.level.chunk(chunk)) if number not in consumed]
+
+    def unload(self, chunk):
+        # Take the chunk's entities out of the game, remembering the ones that were used up
+        for number, entity, handle in self.loaded.pop(chunk):
+            if self.despawn(entity, handle):
+                self.consumed.setdefault(chunk, set()).add(number)
+
+
+class CloudLayer:
+    def __init__(self, screen_width, screen_height, rng, depths=CLOUD_DEPTHS):
+        # Size of the screen the clouds scroll across
+        self.screen_width = screen_width
+        self.screen_height = screen_height
+
+        # Random number generator used to place recycled clouds
+        self.rng = rng
+
+        # Distance beyond the screen edges where clouds wait before they are recycled
+        self.margin = int(screen_width * 0.2) + max(size for factor, size, count in depths)
+
+        # Fixed pool of clouds as [x, y, scroll factor, image], farthest depth first
+        self.clouds = []
+        for factor, size, count in depths:
+            image = ASSETS.load_image("img_block_cloud.png", (size, size))
+            for _ in range(count):
+                self.clouds.append([rng.randint(0, screen_width), rng.randint(0, screen_height // 3), factor, image])
+
+    def update(self, camera_x):
+        for cloud in self.clouds:
+            # Work out where the cloud is on screen at its depth
+            screen_x = cloud[0] - camera_x * cloud[2]
+
+            # Recycle a cloud that scrolled off the left edge to just beyond the right edge
+            if screen_x < -self.margin:
+                cloud[0] += self.screen_width - screen_x + self.rng.randint(0, self.margin)
+                cloud[1] = self.rng.randint(0, self.screen_height // 3)
+
+            # Recycle a cloud that scrolled off the right edge (character walking back) to just beyond the left edge
+            elif screen_x > self.screen_width + self.margin:
+                cloud[0] -= screen_x + cloud[3].get_width() + self.rng.randint(0, self.margin - cloud[3].get_width())
+                cloud[1] = self.rng.randint(0, self.screen_height // 3)
+
+    def draw(self, screen, camera_x):
+        # Draw every pooled cloud shifted by its own share of the camera scroll, farthest first
+        screen.blits([(image, (x - camera_x * factor, y)) for x, y, factor, image in self.clouds], doreturn=False)
+
+
+class HUD:
+    def __init__(self):
+        # HUD elements as [screen rectangle, draw function, value shown], keyed by name
+        self.elements = {}
+
+        # Screen area covered by all elements
+        self.area = pygame.Rect(0, 0, 0, 0)
+
+        # Transparent overlay the elements are composited onto, in screen coordinates
+        self.surface = None
+
+    def add(self, name, rect, draw):
+        # Register an element; it is rendered the first time its value is set
+        rect = pygame.Rect(rect)
+        self.elements[name] = [rect, draw, None, False]
+        self.area = self.area.union(rect) if self.area.width else rect.copy()
+
+        # Make the overlay big enough to hold every element, starting from the top-left of the screen
+        self.surface = pygame.Surface((self.area.right, self.area.bottom), pygame.SRCALPHA)
+        for element in self.elements.values():
+            element[3] = False
+
+    def update(self, name, value):
+        # Leave the element alone if its value has not changed
+        element = self.elements[name]
+        rect, draw, shown, rendered = element
+        if rendered and shown == value:
+            return []
+
+        # Clear the element's area of the overlay and render the element again
+        self.surface.fill((0, 0, 0, 0), rect)
+        self.surface.set_clip(rect)
+        draw(self.surface, value)
+        self.surface.set_clip(None)
+        element[2] = value
+        element[3] = True
+
+        # Return the screen area that changed
+        return [rect]
+
+    def draw(self, screen):
+        # Blit the finished overlay in one go
+        screen.blit(self.surface, (0, 0))
+
+
+class FrameProfiler:
+    def __init__(self, window=120):
+        # Number of recent frames the rolling statistics are computed over
+        self.window = window
+
+        # Recent durations of each phase in seconds, keyed by phase name
+        self.samples = {}
+
+        # Phases of the frame being measured, as (name, start time, duration)
+        self.phases = []
+        self.frame_start = 0
+        self.last_mark = 0
+        self.frame = 0
+
+        # Per-frame trace, recorded only while a trace is running
+        self.trace = None
+
+        # cProfile capture window (profiler, frames left, output path)
+        self.profile = None
+        self.profile_frames_left = 0
+        self.profile_path = None
+
+        # Overlay settings and the text lines rendered for it
+        self.show_overlay = False
+        self.font = None
+        self.overlay_lines = []
+        self.overlay_refresh = 30
+        self.overlay_rect = pygame.Rect(0, 0, 0, 0)
+
+    def begin_frame(self):
+        # Start timing a new frame
+        self.frame_start = self.last_mark = time.perf_counter()
+        self.phases = []
+
+    def mark(self, phase):
+        # Record the time spent since the previous mark as the given phase
+        now = time.perf_counter()
+        self.phases.append((phase, self.last_mark, now - self.last_mark))
+        self.last_mark = now
+
+    def end_frame(self):
+        # Add the phase durations and the total frame time to the rolling windows
+        for phase, start, duration in self.phases:
+            samples = self.samples.get(phase)
+            if samples is None:
+                samples = self.samples[phase] = deque(maxlen=self.window)
+            samples.append(duration)
+        self.samples.setdefault("frame", deque(maxlen=self.window)).append(self.last_mark - self.frame_start)
+
+        # Keep the phases of this frame if a trace is being recorded
+        if self.trace is not None:
+            self.trace.append((self.frame, self.phases))
+        self.frame += 1
+
+        # Stop the cProfile capture once its window of frames is over
+        if self.profile is not None:
+            self.profile_frames_left -= 1
+            if self.profile_frames_left <= 0:
+                self.stop_profile()
+
+    def stats(self, phase):
+        # Get the rolling p50, p95 and maximum of a phase in milliseconds
+        samples = sorted(self.samples.get(phase, ()))
+        if not samples:
+            return 0.0, 0.0, 0.0
+        p50 = samples[int(0.50 * (len(samples) - 1))]
+        p95 = samples[int(0.95 * (len(samples) - 1))]
+        return p50 * 1000, p95 * 1000, samples[-1] * 1000
+
+    def start_trace(self):
+        # Start recording every frame's phases
+        self.trace = []
+
+    def export_trace(self, path):
+        # Write the recorded frames in Chrome trace format (open with chrome://tracing or Perfetto)
+        events = []
+        for frame, phases in self.trace or []:
+            for phase, start, duration in phases:
+                events.append({"name": phase, "ph": "X", "ts": start * 1000000, "dur": duration * 1000000, "pid": 1, "tid": 1, "args": {"frame": frame}})
+        with open(path, "w") as file:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, file)
+
+        # Stop recording
+        self.trace = None
+
+    def capture_profile(self, frames, path):
+        # Run cProfile for the next number of frames and write the statistics to a file
+        self.profile = cProfile.Profile()
+        self.profile_frames_left = frames
+        self.profile_path = path
+        self.profile.enable()
+
+    def stop_profile(self):
+        # Stop the cProfile capture and write its statistics
+        self.profile.disable()
+        self.profile.dump_stats(self.profile_path)
+        self.profile = None
+
+    def draw(self, screen, x, y):
+        # Render the statistics again every few frames, so the overlay itself stays cheap
+        if self.font is None:
+            self.font = pygame.font.Font("font2.otf", 18)
+        if self.frame % self.overlay_refresh == 0 or not self.overlay_lines:
+            rows = [["phase (ms)", "p50", "p95", "max"]]
+            for phase in list(self.samples):
+                rows.append([phase] + ["%.2f" % value for value in self.stats(phase)])
+            self.overlay_lines = [[self.font.render(text, True, WHITE) for text in row] for row in rows]
+
+        # Draw the lines in columns on a dark background
+        column_width = 80
+        line_height = self.font.get_linesize()
+        background = pygame.Surface((column_width * 4 + 30, line_height * len(self.overlay_lines) + 8))
+        background.set_alpha(160)
+        self.overlay_rect = screen.blit(background, (x, y))
+        for row, line in enumerate(self.overlay_lines):
+            for column, text in enumerate(line):
+                screen.blit(text, (x + 6 + column * column_width + (20 if column else 0), y + 4 + row * line_height))
+
+
 class TVBanner:
     def __init__(self, image_path, x, y, width, height):
-        # Load the image and scale it to the specified width and height
-        self.image = pygame.transform.scale(pygame.image.load(image_path).convert_alpha(), (width, height))
+        # Load the image scaled to the specified width and height
+        self.image = ASSETS.load_image(image_path, (width, height))
 
         # Get the rectangle representing the banner's position and size
         self.rect = self.image.get_rect()
@@ -501,6 +2415,10 @@ class PauseMenu:
         for button in self.buttons:
             button.draw(screen)
 
+    def rects(self):
+        # Get the screen areas covered by the buttons, including their borders
+        return [button.rect.inflate(button.border_width * 2 + 2, button.border_width * 2 + 2) for button in self.buttons]
+
     def handle_event(self, event):
         # Check if any button is clicked and return the text of the clicked button
         for button in self.buttons:
@@ -510,276 +2428,329 @@ class PauseMenu:
 
 
 class Game:
-    def __init__(self):
+    def __init__(self, headless=HEADLESS, seed=None, dirty_rects=False, batched_enemies=False, level_length=LEVEL_LENGTH, stream_level=True, look_ahead=2, level_path=None, silent=None, record_path=None, physics_hz=BASE_PHYSICS_HZ, max_fps=None):
+        # Headless games run without a frame-rate cap or waits, and return to the caller instead of exiting
+        self.headless = headless
+        self.max_fps = max_fps if max_fps is not None else (0 if headless else 60)
+
+        # Physics runs in fixed steps decoupled from drawing, catching up at most a few steps per frame when drawing falls behind
+        self.physics_hz = physics_hz
+        self.step_time = 1.0 / physics_hz
+        self.step_scale = BASE_PHYSICS_HZ / physics_hz
+        self.max_catch_up = 5
+
+        # Open only the pygame modules the game needs (headless games are silent unless told otherwise)
+        init_display(headless)
+        init_audio(headless if silent is None else silent)
+        init_fonts()
+
+        # Random number generator of this game, so a seed always produces the same game (a seed is picked if none is given)
+        self.seed = seed if seed is not None else random.getrandbits(32)
+        self.rng = random.Random(self.seed)
+
+        # Settings that decide how the game plays out, so a recording can be replayed in the same game
+        self.settings = {"seed": self.seed, "screen": [SCREEN_WIDTH, SCREEN_HEIGHT], "level_length": level_length, "level_path": level_path,
+                         "stream_level": stream_level, "look_ahead": look_ahead, "physics_hz": physics_hz}
+
+        # Record the input of every frame to a file if asked to
+        self.record_path = record_path
+        self.recording = InputRecording(self.settings) if record_path else None
+
         # Initialize the game screen and clock
         self.screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
         self.clock = pygame.time.Clock()
 
-        # Create sprite groups for different types of sprites
+        # Create sprite groups for different types of sprites (enemies and items sorted along the x-axis, so collision queries only look near the character)
         self.all_sprites = pygame.sprite.Group()
         self.blocks = pygame.sprite.Group()
-        self.enemies = pygame.sprite.Group()
-        self.clouds = pygame.sprite.Group()
-        self.items = pygame.sprite.Group()
+        self.enemies = SweepAndPrune()
+
+        # Optionally keep the enemies in NumPy arrays and move them all in one step (needs NumPy)
+        self.enemy_store = EnemyStore() if batched_enemies and np is not None else None
+        self.items = SweepAndPrune()
+
+        # Index static level geometry by tile coordinates for collision queries
+        self.block_grid = TileGrid(BLOCK_SIZE)
 
-        # Create ground layers
-        self.create_ground(SCREEN_HEIGHT - BLOCK_SIZE, BLOCK_SIZE, "img_block_dirt.png")  # Bottom dirt layer
-        self.create_ground(SCREEN_HEIGHT - 2 * BLOCK_SIZE, BLOCK_SIZE, "img_block_dirt.png")  # Middle dirt layer
-        self.create_ground(SCREEN_HEIGHT - 3 * BLOCK_SIZE, BLOCK_SIZE, "img_block_grass.png")  # Top grass layer
+        # Index drawable sprites along the x-axis so only the ones near the camera are drawn
+        self.render_index = RenderIndex(4 * BLOCK_SIZE)
 
-        # Create initial clouds, obstacles, and enemies
-        self.create_initial_clouds()
-        self.current_cloud = 0
-        self.create_obstacles()
-        self.create_enemies()
+        # Bake the static ground into one surface per screen width of level
+        self.terrain = TerrainLayer(SCREEN_WIDTH, LIGHT_BLUE)
+
+        # Create the pooled parallax clouds, with their own random numbers so they never change the level
+        self.cloud_layer = CloudLayer(SCREEN_WIDTH, SCREEN_HEIGHT, random.Random(self.rng.getrandbits(32)))
 
         # Initialize the main character and add it to the sprite group
         character_initial_x = 100
         character_initial_y = SCREEN_HEIGHT - 7 * BLOCK_SIZE
         self.character = Character(character_initial_x, character_initial_y, BLOCK_SIZE * 2, BLOCK_SIZE * 2)
-        self.all_sprites.add(self.character)
+        self.character.step_scale = self.step_scale
+        self.add_sprite(self.character, moving=True, layer=LAYER_CHARACTER)
         self.camera_x = 0
 
-        # Create and add the castle block to the sprite group
-        castle_x = 300 * BLOCK_SIZE
-        castle_y = SCREEN_HEIGHT - 9 * BLOCK_SIZE
-        self.castle = Scale_Block("img_block_castle.png", castle_x, castle_y, BLOCK_SIZE * 6, BLOCK_SIZE * 6)
-        self.all_sprites.add(self.castle)
+        # Positions before the last physics step, to draw frames in between (None draws the latest step as is)
+        self.previous_camera_x = None
+        self.previous_positions = {}
+        self.previous_store_x = None
+
+        # Camera position the current frame is drawn at
+        self.render_camera_x = 0
+
+        # The castle block is created when the chunk at the end of the level is loaded
+        self.castle = None
+
+        # Generate the level (no level length makes an endless level), or read it from a level file
+        level_seed = self.rng.getrandbits(32)
+        self.level = LevelFile(level_path) if level_path else ProceduralLevel(level_seed, level_length)
+
+        # Stream the level in chunks around the camera, or load it all at once
+        self.streamer = LevelStreamer(self.level, self.spawn_entity, self.despawn_entity, SCREEN_WIDTH, look_ahead)
+        self.stream_level = stream_level or self.level.last_chunk is None
+        if self.stream_level:
+            self.streamer.update(self.camera_x, look_ahead + 1)
+        else:
+            self.streamer.load_all()
 
         # Initialize the character's health bar
         self.character_health_bar = HealthBar(20, 20, 500, 40, self.character.max_health)
         self.character.update_health(0)  # Update character's health bar
 
-        # Timer related variables
-        self.timer_check = False
+        # Timed item effects, ended by simulation tick, and the font of the countdown shown while any of them runs
+        self.effects = EffectScheduler()
         self.timer_font = pygame.font.Font("font2.otf", 52)
-        self.timer_active = False
-        self.timer = 0
+        self.timer_glyphs = GlyphAtlas(self.timer_font, BLACK, "0123456789.s")
 
         # Game over and victory banners along with corresponding sounds
-        self.game_over_banner = pygame.image.load("img_banner_game_over.png").convert_alpha()
-        self.game_over_banner = pygame.transform.scale(self.game_over_banner, (int(SCREEN_WIDTH * 0.8), int(SCREEN_HEIGHT * 0.4)))
-        self.game_over_sound = pygame.mixer.Sound("audio_game_over.mp3")
+        self.game_over_banner = ASSETS.load_image("img_banner_game_over.png", (int(SCREEN_WIDTH * 0.8), int(SCREEN_HEIGHT * 0.4)))
+        self.game_over_sound = SOUNDS.load_sound("audio_game_over.mp3")
 
-        self.victory_banner = pygame.image.load("img_banner_game_clear.png").convert_alpha()
-        self.victory_banner = pygame.transform.scale(self.victory_banner, (int(SCREEN_WIDTH * 0.8), int(SCREEN_HEIGHT * 0.4)))
-        self.victory_sound = pygame.mixer.Sound("audio_winner.mp3")
+        self.victory_banner = ASSETS.load_image("img_banner_game_clear.png", (int(SCREEN_WIDTH * 0.8), int(SCREEN_HEIGHT * 0.4)))
+        self.victory_sound = SOUNDS.load_sound("audio_winner.mp3")
 
         # Sounds for different game events
-        self.hitting_sound = pygame.mixer.Sound("audio_hitting.mp3")
-        self.hitting_sound.set_volume(0.1)
-        self.killing_sound = pygame.mixer.Sound("audio_killing.mp3")
-        self.buff_sound = pygame.mixer.Sound("audio_power_up.mp3")
-        self.debuff_sound = pygame.mixer.Sound("audio_power_down.mp3")
-        self.recovery_sound = pygame.mixer.Sound("audio_recovery.mp3")
-        self.back_sound = pygame.mixer.Sound("audio_background_music.mp3")
-        self.back_sound.set_volume(0.5)
-        self.pause_sound = pygame.mixer.Sound("audio_pause.mp3")
-        self.continue_sound = pygame.mixer.Sound("audio_continue.mp3")
-        self.exit_sound = pygame.mixer.Sound("audio_exit.mp3")
+        self.hitting_sound = SOUNDS.load_sound("audio_hitting.mp3", 0.1)
+        self.killing_sound = SOUNDS.load_sound("audio_killing.mp3")
+        self.buff_sound = SOUNDS.load_sound("audio_power_up.mp3")
+        self.debuff_sound = SOUNDS.load_sound("audio_power_down.mp3")
+        self.recovery_sound = SOUNDS.load_sound("audio_recovery.mp3")
+        self.pause_sound = SOUNDS.load_sound("audio_pause.mp3")
+        self.continue_sound = SOUNDS.load_sound("audio_continue.mp3")
+        self.exit_sound = SOUNDS.load_sound("audio_exit.mp3")
+
+        # Background music is streamed from disk when the game starts
+        self.music_path = "audio_background_music.mp3"
+        self.music_volume = 0.5
 
         # Initialize TV banner and pause menu
         self.tv_banner = TVBanner("img_banner_tv.png", SCREEN_WIDTH - 95, 20, 75, 75)
         self.pause_menu = PauseMenu(SCREEN_WIDTH, SCREEN_HEIGHT)
         self.paused = False
 
+        # State of the game loop ("game_over", "win" or "exit" once the game has ended)
+        self.running = False
+        self.outcome = None
 
-    def update_timer(self):
-        # Update the timer if it is active and greater than 0
-        if self.timer_active and self.timer > 0:
-            self.timer -= 1
-        elif self.timer == 0:
-            # If timer reaches 0, deactivate it and reset character effects
-            self.timer_active = False
-            self.character.reset_effects()
-
-    def draw_timer(self):
-        # Draw the timer on the screen if it's active
-        if self.timer_active:
-            # Render the timer text
-            timer_text = self.timer_font.render(str(int(self.timer / 6) / 10) + "s", True, BLACK)
-    
-            # Get the rectangle representing the timer text
-            timer_rect = timer_text.get_rect()
-
-            # Set the position of the timer text on the screen
-            timer_rect.topleft = (30, 80)
-
-            # Draw the timer text on the screen
-            self.screen.blit(timer_text, timer_rect)
-
-    def create_obstacles(self):
-        # Initialize the x-coordinate for obstacle placement
-        i = random.randint(5, 15)
-
-        # Loop until reaching the specified x-coordinate limit
-        while i <= 290:
-            # Randomly decide whether to create a question block or a brick block
-            if random.randint(1, 2) == 2:
-
-                # Create a question block at a random y-coordinate within the specified range
-                question_block = Question_Block(i * BLOCK_SIZE, random.randint(SCREEN_HEIGHT//2, SCREEN_HEIGHT - 5 * BLOCK_SIZE))
-
-                # Add the question block to the blocks sprite group and all sprites group
-                self.blocks.add(question_block)
-                self.all_sprites.add(question_block)
-            else:
-                # Create a brick block at a random y-coordinate within the specified range
-                brick = Scale_Block("img_block_brick.png", i * BLOCK_SIZE, random.randint(SCREEN_HEIGHT//2, SCREEN_HEIGHT - 5 * BLOCK_SIZE), BLOCK_SIZE, BLOCK_SIZE)
-                
-                # Add the brick block to the blocks sprite group and all sprites group
-                self.blocks.add(brick)
-                self.all_sprites.add(brick)
-            
-            # Move to the next x-coordinate with a random increment
-            i += random.randint(5, 15)
-
-
-    def create_ground(self, y, height, image_path):
-        # Loop through each segment of the ground and create blocks for each segment
-        for x in range(-6 * BLOCK_SIZE, 50 * BLOCK_SIZE, BLOCK_SIZE):
-            ground = Scale_Block(image_path, x, y, BLOCK_SIZE, height)
-            # Add the ground block to the blocks sprite group and all sprites group
-            self.blocks.add(ground)
-            self.all_sprites.add(ground)
-
-        for x in range(55 * BLOCK_SIZE, 100 * BLOCK_SIZE, BLOCK_SIZE):
-            ground = Scale_Block(image_path, x, y, BLOCK_SIZE, height)
-            self.blocks.add(ground)
-            self.all_sprites.add(ground)
-
-        for x in range(105 * BLOCK_SIZE, 150 * BLOCK_SIZE, BLOCK_SIZE):
-            ground = Scale_Block(image_path, x, y, BLOCK_SIZE, height)
-            self.blocks.add(ground)
-            self.all_sprites.add(ground)
-
-        for x in range(155 * BLOCK_SIZE, 200 * BLOCK_SIZE, BLOCK_SIZE):
-            ground = Scale_Block(image_path, x, y, BLOCK_SIZE, height)
-            self.blocks.add(ground)
-            self.all_sprites.add(ground)
-
-        for x in range(205 * BLOCK_SIZE, 250 * BLOCK_SIZE, BLOCK_SIZE):
-            ground = Scale_Block(image_path, x, y, BLOCK_SIZE, height)
-            self.blocks.add(ground)
-            self.all_sprites.add(ground)
-
-        for x in range(255 * BLOCK_SIZE, 400 * BLOCK_SIZE, BLOCK_SIZE):
-            ground = Scale_Block(image_path, x, y, BLOCK_SIZE, height)
-            self.blocks.add(ground)
-            self.all_sprites.add(ground)
-
-
-    def create_initial_clouds(self):
-        # Generate initial clouds at random positions within the upper half of the screen
-        for _ in range(7):
-            cloud = Scale_Block("img_block_cloud.png", random.randint(0, SCREEN_WIDTH), random.randint(0, SCREEN_HEIGHT // 3), BLOCK_SIZE, BLOCK_SIZE)
-            
-            # Add the cloud to the clouds sprite group and all sprites group
-            self.clouds.add(cloud)
-            self.all_sprites.add(cloud)
-
-    def create_clouds(self):
-        # Create additional clouds if the current cloud count is below a certain threshold
-        if self.current_cloud < random.randint(10, 15):  
-            # Generate a new cloud at a random position within a certain range
-            cloud = Scale_Block("img_block_cloud.png", self.camera_x + SCREEN_WIDTH + random.randint(0, int(SCREEN_WIDTH * 0.2)), random.randint(0, SCREEN_HEIGHT // 3), BLOCK_SIZE, BLOCK_SIZE)
-            
-            # Add the cloud to the clouds sprite group and all sprites group
-            self.clouds.add(cloud)
-            self.all_sprites.add(cloud)
-            
-            # Increment the current cloud count
-            self.current_cloud += 1
+        # Per-phase frame timings (F3 shows the overlay, F4 starts/stops a trace, F5 profiles 300 frames)
+        self.profiler = FrameProfiler()
 
+        # Dirty-rect mode redraws and presents only the changed screen regions while the camera stands still
+        self.dirty_rects = dirty_rects
+        self.full_redraw = True
+        self.drawn_sprites = {}
+        self.drawn_camera_x = None
 
-    def create_enemies(self):
-        # Define different enemy types along with their images and attributes
-        enemy_types = [
-            ("img_enemy_mushroom.png", 1),
-            ("img_enemy_robot.png", 2),
-            ("img_enemy_orc.png", 3)
-        ]
+        # HUD overlay with the health bar, timer and TV banner, each re-rendered only when its value changes
+        self.hud = HUD()
+        self.hud.add("health", self.character_health_bar.outer_rect, self.draw_health_element)
+        self.hud.add("timer", pygame.Rect((30, 80), self.timer_font.size("88.8s")), self.draw_timer_element)
+        self.hud.add("tv_banner", self.tv_banner.rect, self.draw_tv_banner_element)
 
-        # Loop through x-coordinates to create enemies
-        for i in range(9, 275, 17):
-            # Randomly select an enemy type
-            image_path, number = random.choice(enemy_types)
 
-            # Create an enemy instance with the selected image and attributes
-            enemy = Enemy(image_path, i * BLOCK_SIZE, SCREEN_HEIGHT - 4 * BLOCK_SIZE, 100 * number, number, number * 0.75)  
-            
-            # Add the enemy to the enemies sprite group and all sprites group
-            self.enemies.add(enemy)
-            self.all_sprites.add(enemy)
+    def timer_text(self):
+        # Get the countdown to the end of the last running effect, in seconds, while any effect runs
+        if len(self.effects):
+            return str(int(self.effects.remaining() * self.step_scale / 6) / 10) + "s"
+        return None
+
+    def draw_health_element(self, surface, health):
+        # Update and draw character's health bar
+        self.character_health_bar.update(health)
+        self.character_health_bar.draw(surface)
+
+    def draw_timer_element(self, surface, text):
+        # Draw the timer text from pre-rendered digit glyphs while an effect runs
+        if text is not None:
+            self.timer_glyphs.draw(surface, text, (30, 80))
+
+    def draw_tv_banner_element(self, surface, image):
+        # Copy the TV banner image onto the cleared overlay, keeping its own alpha values
+        surface.blit(image, self.tv_banner.rect, special_flags=pygame.BLEND_RGBA_MAX)
+
+    def add_sprite(self, sprite, moving=False, layer=LAYER_BLOCKS):
+        # Add a sprite to the all sprites group and the render index
+        self.all_sprites.add(sprite)
+        self.render_index.add(sprite, moving, layer)
+
+    def add_block(self, block):
+        # Add a static block to the blocks sprite group, all sprites group and collision grid
+        self.blocks.add(block)
+        self.add_sprite(block)
+        self.block_grid.add(block)
+
+    def add_ground(self, ground):
+        # Add a ground tile to the blocks sprite group and collision grid, and draw it through the terrain layer
+        self.blocks.add(ground)
+        self.block_grid.add(ground)
+        self.terrain.add(ground)
+
+    def export_level(self, path):
+        # Save the level of this game as a level file
+        LevelFile.save(self.level, path)
+
+    def spawn_entity(self, entity):
+        # Create the sprite of a level entity (or its slot in the enemy store) and add it to the game
+        kind, x, y = entity[:3]
+        if kind == "ground":
+            ground = Scale_Block(entity[3], x, y, BLOCK_SIZE, BLOCK_SIZE)
+            self.add_ground(ground)
+            return ground
+        if kind == "brick":
+            brick = Scale_Block("img_block_brick.png", x, y, BLOCK_SIZE, BLOCK_SIZE)
+            self.add_block(brick)
+            return brick
+        if kind == "question":
+            question_block = Question_Block(x, y)
+            self.add_block(question_block)
+            return question_block
+        if kind == "enemy":
+            return self.add_enemy(entity[3], x, y, *entity[4:])
+        if kind == "castle":
+            self.castle = Scale_Block("img_block_castle.png", x, y, BLOCK_SIZE * 6, BLOCK_SIZE * 6)
+            self.add_sprite(self.castle, layer=LAYER_CASTLE)
+            return self.castle
+        raise ValueError("Unknown level entity: " + kind)
+
+    def despawn_entity(self, entity, handle):
+        # Enemies in the store only free their slot
+        if entity[0] == "enemy" and self.enemy_store is not None:
+            used_up = not self.enemy_store.alive[handle]
+            self.enemy_store.remove(handle)
+            return used_up
+
+        # Take the sprite out of every group and index, telling whether it was already used up (hit or defeated)
+        used_up = not handle.alive()
+        handle.kill()
+        self.block_grid.remove(handle)
+        self.render_index.remove(handle)
+        if entity[0] == "ground":
+            self.terrain.remove(handle)
+        elif entity[0] == "castle":
+            self.castle = None
+        return used_up
+
+    def add_enemy(self, image_path, x, y, movement_range, max_health, speed):
+        # Put the enemy in the batched store if there is one
+        if self.enemy_store is not None:
+            return self.enemy_store.add(image_path, x, y, movement_range, max_health, speed)
+
+        # Otherwise create an enemy sprite and add it to the enemies sprite group and all sprites group
+        enemy = Enemy(image_path, x, y, movement_range, max_health, speed)
+        enemy.step_scale = self.step_scale
+        self.enemies.add(enemy)
+        self.add_sprite(enemy, moving=True, layer=LAYER_ENEMIES)
+        return enemy
+
+    def enemy_hits(self):
+        # Get the enemies colliding with the character, or passed through by it during the step
+        start = self.character.step_start
+        rect = self.character.rect
+        if self.enemy_store is not None:
+            store = self.enemy_store
+            indices = list(store.overlapping(rect))
+            if abs(rect.left - start.left) > rect.width or abs(rect.top - start.top) > rect.height:
+                indices = sorted(set(indices) | {index for index in store.overlapping(start.union(rect)) if tunnelled(start, rect, store.rect(index))})
+            return [StoredEnemy(store, index) for index in indices]
+        return self.enemies.sweep(start, rect)
+
+    def remove_enemy(self, enemy):
+        # Remove a defeated enemy from the game (enemies in the store are already marked dead)
+        if self.enemy_store is None:
+            self.enemies.remove(enemy)
+            self.all_sprites.remove(enemy)
 
 
     def check_collisions(self):
-        # Check for vertical collisions between character and blocks
-        hits_vertical = pygame.sprite.spritecollide(self.character, self.blocks, False)
+        # Check for vertical collisions between character and the blocks in the grid cells under it
+        hits_vertical = self.block_grid.query(self.character.rect)
         if hits_vertical:
             for block in hits_vertical:
                 # Handle collision when character is moving downwards
                 if self.character.speed_y > 0: 
                     self.character.on_ground = True
                     self.character.rect.bottom = block.rect.top
+                    self.character.pos_y = self.character.rect.y
                     self.character.speed_y = 0
 
                     # Check if the collided block is a question block and not yet hit
                     if isinstance(block, Question_Block) and not block.is_hit:
-                        # Hit the block to reveal item
-                        item = block.hit()
+                        # Hit the block to reveal item and take it out of the collision grid
+                        item = block.hit(self.rng)
+                        self.block_grid.remove(block)
                         if item:
                             self.items.add(item)  
-                            self.all_sprites.add(item)
+                            self.add_sprite(item, layer=LAYER_ITEMS)
 
                             # Trigger character jump if on ground after hitting question block
                             if self.character.on_ground:
                                 self.character.speed_y = self.character.jump_strength
                                 self.character.on_ground = False
 
-        # Check for horizontal collisions between character and blocks
-        hits_horizontal = pygame.sprite.spritecollide(self.character, self.blocks, False)
+        # Check for horizontal collisions between character and the blocks in the grid cells under it
+        hits_horizontal = self.block_grid.query(self.character.rect)
         if hits_horizontal:
             for block in hits_horizontal:
                 # Handle collision when character is moving right
                 if self.character.speed_x > 0:  
                     self.character.rect.right = block.rect.left
+                    self.character.pos_x = self.character.rect.x
 
                 # Handle collision when character is moving left
                 elif self.character.speed_x < 0:  
                     self.character.rect.left = block.rect.right
+                    self.character.pos_x = self.character.rect.x
        
        # Update character's on_ground state if no vertical collisions detected
         if not hits_vertical:
             self.character.on_ground = False
        
         # Check collision with the castle block to trigger win condition
-        if pygame.sprite.collide_rect(self.character, self.castle):
+        if self.castle is not None and pygame.sprite.collide_rect(self.character, self.castle):
             self.win()
 
         # Check for collisions between character and enemies
-        enemy_hits = pygame.sprite.spritecollide(self.character, self.enemies, False)
+        enemy_hits = self.enemy_hits()
         if enemy_hits:
             for enemy in enemy_hits:
                 # Handle collision when character is moving downwards and below enemy
                 if self.character.speed_y > 0 and self.character.rect.bottom <= enemy.rect.bottom:
                     enemy.take_damage(self.character.jump_damage) 
-                    self.character.jumping_sound.play()
+                    VOICES.play(self.character.jumping_sound)
                     self.character.speed_y = self.character.jump_strength  
        
                     # Remove enemy if its health drops to zero
                     if enemy.current_health <= 0:
-                        self.enemies.remove(enemy)  
-                        self.character.jumping_sound.stop()
-                        self.killing_sound.play()
-                        self.all_sprites.remove(enemy)
+                        self.remove_enemy(enemy)
+                        VOICES.stop(self.character.jumping_sound)
+                        VOICES.play(self.killing_sound)
        
-                # Handle collision when character is hit by enemy horizontally
+                # Handle collision when character is hit by enemy horizontally, taking damage and being knocked up at the same rate per second whatever the physics rate
+                # (the knock-back speed makes up for the gravity added before the next move, which grows with the step)
                 elif not enemy.has_hit_character:  
                     if not self.character.immune_to_damage:
-                        self.character.health -= enemy.current_health 
-                        self.hitting_sound.play() 
-                        self.character.speed_y = -2
+                        self.character.health -= enemy.current_health * self.step_scale
+                        VOICES.play(self.hitting_sound) 
+                        self.character.speed_y = -2 + self.character.gravity * (1 - self.step_scale)
                         self.character.on_ground = False
                         self.character_health_bar.update(self.character.health)
        
@@ -789,44 +2760,39 @@ class Game:
 
 
     def check_item_collisions(self):
-        # Check for collisions between character and items
-        item_hits = pygame.sprite.spritecollide(self.character, self.items, False)
+        # Check for collisions between character and items, including items passed through during the step
+        item_hits = self.items.sweep(self.character.step_start, self.character.rect)
 
         # Iterate through each item collided with
         for item in item_hits:
-            # Check the type of item and apply its effect accordingly
-            if isinstance(item, RecoveryItem) or isinstance(item, ConfusionItem):
-                
-                # Apply effect and play corresponding sound
+            # Run a timed effect through the effect scheduler, next to any others already running (picking up the same kind again restarts its time)
+            if item.duration:
+                self.effects.start(type(item), max(1, round(item.duration / self.step_scale)), item.apply_effect, item.expire_effect, self.character)
+                VOICES.play(self.buff_sound)
+
+            # Apply a one-off effect and play its sound
+            else:
                 item.apply_effect(self.character)
                 if isinstance(item, RecoveryItem):
-                    self.recovery_sound.play()
+                    VOICES.play(self.recovery_sound)
                 else:
-                    self.debuff_sound.play()
-                
-                # Remove the item from sprite groups
-                item.kill()
-            else:
-                # If the timer is not active, apply the effect and start the timer
-                if not self.timer_active:
-                    # Apply effect and play buff sound
-                    item.apply_effect(self.character)
-                    self.buff_sound.play()
-                    
-                    # Set the timer duration based on the type of item
-                    if isinstance(item, SpeedUpItem) or isinstance(item, HighJumpItem) or isinstance(item, MuscleUpItem) or isinstance(item, IronBodyItem):
-                        self.timer = 300
-                        self.timer_active = True
-                    
-                    # Remove the item from sprite groups
-                    item.kill()
+                    VOICES.play(self.debuff_sound)
+
+            # Remove the item from sprite groups
+            item.kill()
 
 
 
     def game_over(self):
         # Stop background music and play game over sound
-        self.back_sound.stop()
-        self.game_over_sound.play()
+        SOUNDS.stop_music()
+        VOICES.play(self.game_over_sound)
+
+        # In headless mode, record the outcome and hand control back to the caller
+        if self.headless:
+            self.outcome = "game_over"
+            self.running = False
+            return
 
         # Display game over banner
         banner_rect = self.game_over_banner.get_rect(center=(SCREEN_WIDTH // 2, SCREEN_HEIGHT // 2))
@@ -842,8 +2808,14 @@ class Game:
 
     def win(self):
         # Stop background music and play victory sound
-        self.back_sound.stop()
-        self.victory_sound.play()
+        SOUNDS.stop_music()
+        VOICES.play(self.victory_sound)
+
+        # In headless mode, record the outcome and hand control back to the caller
+        if self.headless:
+            self.outcome = "win"
+            self.running = False
+            return
         
         # Display victory banner
         banner_rect = self.victory_banner.get_rect(center=(SCREEN_WIDTH // 2, SCREEN_HEIGHT // 2))
@@ -858,142 +2830,486 @@ class Game:
         sys.exit()  # Exit the program
 
 
-    def run(self):
-        # Play background music
-        self.back_sound.play(loops=-1)
-        running = True
-        while running:
-            for event in pygame.event.get():
-                # Check for quit event
-                if event.type == pygame.QUIT:
-                    running = False
-
-                # Check for mouse button click on TV banner to pause the game
-                elif event.type == pygame.MOUSEBUTTONDOWN and event.button == 1:
-                    if self.tv_banner.rect.collidepoint(event.pos):
-                        self.paused = True
-                        self.pause_sound.stop()
-                        self.pause_sound.play()
-
-            # Check if the game is paused
-            if self.paused:
-                # Handle events in the pause menu
+    def pause(self):
+        # Pause the game and play the pause sound
+        self.paused = True
+        VOICES.play(self.pause_sound)
+
+    def resume(self):
+        # Continue the game and play the continue sound
+        VOICES.play(self.continue_sound)
+        self.paused = False
+
+        # Redraw the whole screen to erase the pause menu
+        self.full_redraw = True
+
+    def exit(self):
+        # Play the exit sound and leave the game
+        VOICES.play(self.exit_sound)
+
+        # In headless mode, record the outcome and hand control back to the caller
+        if self.headless:
+            self.outcome = "exit"
+            self.running = False
+            return
+        pygame.time.wait(1100)
+        pygame.quit()
+        sys.exit()
+
+    def handle_events(self):
+        for event in pygame.event.get():
+            # Check for quit event
+            if event.type == pygame.QUIT:
+                self.running = False
+
+            # Check for the profiler keys
+            elif event.type == pygame.KEYDOWN and event.key in (pygame.K_F3, pygame.K_F4, pygame.K_F5):
+                self.handle_profiler_key(event.key)
+
+            # Handle events in the pause menu while the game is paused
+            elif self.paused:
                 result = self.pause_menu.handle_event(event)
                 if result == "Continue":
-                    self.continue_sound.play()
-                    self.paused = False
+                    self.record_input(INPUT_CONTINUE)
+                    self.resume()
                 elif result == "Exit":
-                    self.exit_sound.play()
-                    pygame.time.wait(1100)
-                    pygame.quit()
-                    sys.exit()
-                else:
-                    self.pause_menu.draw(self.screen)
+                    self.record_input(INPUT_EXIT)
+                    self.exit()
+
+            # Check for mouse button click on TV banner to pause the game
+            elif event.type == pygame.MOUSEBUTTONDOWN and event.button == 1:
+                if self.tv_banner.rect.collidepoint(event.pos):
+                    self.record_input(INPUT_PAUSE)
+                    self.pause()
+
+    def handle_profiler_key(self, key):
+        # Toggle the profiler overlay, redrawing the whole screen so it appears (or its last image is erased) in dirty-rect mode too
+        if key == pygame.K_F3:
+            self.profiler.show_overlay = not self.profiler.show_overlay
+            self.full_redraw = True
+
+        # Start a trace, or write the running one to a file
+        elif key == pygame.K_F4:
+            if self.profiler.trace is None:
+                self.profiler.start_trace()
             else:
-                # Update all sprites, check collisions, and update timer
-                self.all_sprites.update()
-                self.check_collisions()
-                self.check_item_collisions()
-                self.update_timer()
+                self.profiler.export_trace("frame_trace.json")
 
-                # Check if the character's game is over
-                if self.character.is_game_over:
-                    self.game_over()
+        # Profile the next 300 frames with cProfile
+        elif key == pygame.K_F5 and self.profiler.profile is None:
+            self.profiler.capture_profile(300, "frame_profile.prof")
 
-                # Adjust camera position based on character's position
-                if self.character.rect.right > SCREEN_WIDTH * 0.7:
-                    self.camera_x = self.character.rect.right - SCREEN_WIDTH * 0.7
-                elif self.character.rect.left < SCREEN_WIDTH * 0.3:
-                    self.camera_x = self.character.rect.left - SCREEN_WIDTH * 0.3
-
-                # Randomly create clouds
-                if random.randint(1, 100) <= 2:
-                    self.create_clouds()
-
-                # Fill the screen with light blue color
-                self.screen.fill(LIGHT_BLUE)
-
-                # Draw all sprites on the screen with adjusted positions
-                for sprite in self.all_sprites:
-                    self.screen.blit(sprite.image, (sprite.rect.x - self.camera_x, sprite.rect.y))
+    def update(self):
+        # Update all sprites, check collisions, and end the item effects that are due, timing each phase
+        profiler = self.profiler
+        self.all_sprites.update()
+        if self.enemy_store is not None:
+            self.enemy_store.step(self.step_scale)
+        profiler.mark("sprites")
+        self.check_collisions()
+        profiler.mark("collisions")
+        self.check_item_collisions()
+        profiler.mark("items")
+        self.effects.advance()
+
+        # Check if the character's game is over
+        if self.character.is_game_over:
+            self.game_over()
+
+        # Adjust camera position based on character's position
+        self.update_camera()
+        profiler.mark("timer")
+
+        # Load the level chunks coming into view and unload the ones left far behind
+        if self.stream_level:
+            self.streamer.update(self.camera_x)
+            profiler.mark("level")
+
+        # Recycle the clouds that scrolled off screen
+        self.cloud_layer.update(self.camera_x)
+        profiler.mark("clouds")
+
+    def update_camera(self):
+        # Scroll the camera when the character leaves the middle of the screen
+        if self.character.rect.right > SCREEN_WIDTH * 0.7:
+            self.camera_x = self.character.rect.right - SCREEN_WIDTH * 0.7
+        elif self.character.rect.left < SCREEN_WIDTH * 0.3:
+            self.camera_x = self.character.rect.left - SCREEN_WIDTH * 0.3
+
+    def draw(self, alpha=None):
+        # Look up what is inside the camera window, placed part of the way (alpha) from the previous physics step to the latest one
+        self.render_camera_x = self.interpolate(self.previous_camera_x, self.camera_x, alpha)
+        visible = self.visible_drawables(alpha)
+
+        # In dirty-rect mode, redraw only what changed unless the camera scrolled
+        if self.dirty_rects and not self.full_redraw and self.render_camera_x == self.drawn_camera_x:
+            rects = self.draw_dirty(visible)
+            self.profiler.mark("draw")
+            return rects
+
+        # Fill the screen with light blue color and draw the clouds behind everything else
+        self.screen.fill(LIGHT_BLUE)
+        self.cloud_layer.draw(self.screen, self.render_camera_x)
+
+        # Draw the baked ground chunks, then the sprites inside the camera window with adjusted positions
+        self.terrain.draw(self.screen, self.render_camera_x)
+        self.blit_batch([(image, position) for key, image, position in visible])
+
+        # Bring the HUD overlay up to date and draw it with the profiler overlay
+        self.update_hud()
+        self.draw_hud()
+
+        # Remember what was drawn so the next frame can find the regions that changed
+        if self.dirty_rects:
+            self.remember_frame(self.screen_rects(visible))
+        self.profiler.mark("draw")
+
+        # The whole screen has to be presented
+        return None
 
-                # Update and draw character's health bar
-                self.character_health_bar.update(self.character.health)
-                self.character_health_bar.draw(self.screen)
+    def update_hud(self):
+        # Re-render the HUD elements whose values changed and return the screen areas they cover
+        changed = self.hud.update("health", self.character.health)
+        changed += self.hud.update("timer", self.timer_text())
+        changed += self.hud.update("tv_banner", self.tv_banner.image)
+        return changed
+
+    def draw_hud(self):
+        # Blit the cached HUD overlay
+        self.hud.draw(self.screen)
+
+        # Draw the profiler overlay next to the health bar
+        if self.profiler.show_overlay:
+            self.profiler.draw(self.screen, 540, 20)
+
+    def screen_rects(self, visible):
+        # Get the screen rectangle and image of everything visible
+        return {key: (image.get_rect(topleft=position), image) for key, image, position in visible}
+
+    def remember_frame(self, drawn_sprites):
+        # Store what the presented frame shows
+        self.drawn_sprites = drawn_sprites
+        self.drawn_camera_x = self.render_camera_x
+        self.full_redraw = False
+
+    def draw_dirty(self, visible):
+        # Find what moved, changed image, appeared or disappeared since the last frame
+        drawn_sprites = self.screen_rects(visible)
+        dirty = []
+        for sprite, drawn in drawn_sprites.items():
+            previous = self.drawn_sprites.get(sprite)
+            if previous != drawn:
+                dirty.append(drawn[0])
+                if previous is not None:
+                    dirty.append(previous[0])
+        for sprite, previous in self.drawn_sprites.items():
+            if sprite not in drawn_sprites:
+                dirty.append(previous[0])
+
+        # Add the HUD elements whose values changed, and the profiler overlay while it is shown
+        dirty.extend(self.update_hud())
+        if self.profiler.show_overlay:
+            dirty.append(self.profiler.overlay_rect)
+
+        # Grow the regions a little to cover rounding of fractional camera positions, and keep them on screen
+        screen_rect = self.screen.get_rect()
+        dirty = [rect.inflate(4, 4).clip(screen_rect) for rect in dirty]
+        dirty = [rect for rect in dirty if rect.width and rect.height]
+
+        # Redraw each dirty region, clipping every blit to it
+        camera_x = self.render_camera_x
+        for rect in dirty:
+            self.screen.set_clip(rect)
+            self.screen.fill(LIGHT_BLUE)
+            self.cloud_layer.draw(self.screen, camera_x)
+            self.terrain.draw(self.screen, camera_x)
+            self.blit_batch([(image, position) for key, image, position in visible if drawn_sprites[key][0].colliderect(rect)])
+            if rect.colliderect(self.hud.area) or (self.profiler.show_overlay and rect.colliderect(self.profiler.overlay_rect)):
+                self.draw_hud()
+        self.screen.set_clip(None)
+
+        # Remember the frame and return the regions to present
+        self.remember_frame(drawn_sprites)
+        return dirty
+
+    def visible_drawables(self, alpha=None):
+        # Get (key, image, screen position) of everything inside the camera window, in draw order
+        camera_x = self.render_camera_x
+        visible = []
+
+        # Enemies in the batched store are drawn first, like the enemy sprites that were added before the character
+        if self.enemy_store is not None:
+            store = self.enemy_store
+            previous_x = self.previous_store_x if alpha is not None else None
+            for index in store.visible(camera_x, camera_x + SCREEN_WIDTH):
+                x = store.x[index]
+                if previous_x is not None and index < len(previous_x):
+                    x = self.interpolate(previous_x[index], x, alpha)
+                visible.append((("enemy", index), store.images[index], (x - camera_x, store.y[index])))
+
+        # Re-bucket the sprites that moved, then look up only the ones overlapping the camera window
+        self.render_index.refresh()
+        previous_positions = self.previous_positions if alpha is not None else {}
+        for sprite in self.render_index.visible(camera_x, camera_x + SCREEN_WIDTH, 0, SCREEN_HEIGHT):
+            x, y = sprite.rect.topleft
+            previous = previous_positions.get(sprite)
+            if previous is not None:
+                x = self.interpolate(previous[0], x, alpha)
+                y = self.interpolate(previous[1], y, alpha)
+            visible.append((sprite, sprite.image, (x - camera_x, y)))
+        return visible
+
+    def blit_batch(self, batch):
+        # Submit every (image, position) pair to the screen in one batched call
+        if hasattr(self.screen, "fblits"):
+            self.screen.fblits(batch)
+        else:
+            self.screen.blits(batch, doreturn=False)
+
+    def step_input(self, mask):
+        # Carry out a menu action, or advance the game by one physics step with the mask's keys held down
+        if mask & INPUT_PAUSE and not self.paused:
+            self.pause()
+        elif mask & INPUT_CONTINUE and self.paused:
+            self.resume()
+        elif mask & INPUT_EXIT and self.paused:
+            self.exit()
+        elif not mask & (INPUT_PAUSE | INPUT_CONTINUE | INPUT_EXIT) and not self.paused:
+            self.step(KeyState.from_mask(mask))
+        return self.outcome
+
+    def record_input(self, mask):
+        # Add a physics step's keys or a menu action to the recording
+        if self.recording is not None:
+            self.recording.record(mask)
+
+    def read_keys(self):
+        # Get the keys held down as input mask bits
+        pressed = pygame.key.get_pressed()
+        mask = 0
+        for key, bit in INPUT_KEYS.items():
+            if pressed[key]:
+                mask |= bit
+        return mask
+
+    def remember_positions(self):
+        # Keep the positions before a physics step, so frames drawn before the next step can be interpolated
+        self.previous_camera_x = self.camera_x
+        self.previous_positions = {sprite: sprite.rect.topleft for sprite in self.render_index.moving}
+        if self.enemy_store is not None:
+            self.previous_store_x = self.enemy_store.x[:self.enemy_store.count].copy()
+
+    def interpolate(self, previous, current, alpha):
+        # Blend two positions of a physics step, except for jumps of more than a block (spawns and reused slots)
+        if alpha is None or previous is None or abs(current - previous) > BLOCK_SIZE:
+            return current
+        return previous + (current - previous) * alpha
+
+    def save_recording(self):
+        # Write the input recorded so far
+        if self.recording is not None:
+            self.recording.save(self.record_path)
+
+    def step(self, keys=()):
+        # Advance the game by one frame with the given keys held down, without touching the display
+        if self.outcome is None:
+            self.character.keys = keys if isinstance(keys, KeyState) else KeyState(keys)
+            self.profiler.begin_frame()
+            self.update()
+            self.profiler.end_frame()
+
+        # Return the outcome so the caller knows when the game has ended
+        return self.outcome
+
+    def run(self, max_frames=None):
+        # Play background music
+        SOUNDS.play_music(self.music_path, self.music_volume)
+        self.running = True
+        frames = 0
+
+        # Real time not yet simulated, and when the previous frame started
+        accumulator = 0.0
+        last_time = time.perf_counter()
+
+        # Save the input recording however the game ends (the game over, victory and exit paths end the program)
+        try:
+            while self.running and (max_frames is None or frames < max_frames):
+                self.profiler.begin_frame()
+                self.handle_events()
+
+                # Read the keys once per frame, so every physics step of the frame sees the same keys
+                keys = self.read_keys()
+                self.profiler.mark("events")
+
+                # Check if the game is paused
+                if self.paused:
+                    self.pause_menu.draw(self.screen)
+                    rects = self.pause_menu.rects() + [self.tv_banner.rect] if self.dirty_rects else None
+                    self.profiler.mark("pause_menu")
 
-                # Draw timer
-                self.draw_timer()
+                    # Time spent in the menu is not simulated
+                    last_time = time.perf_counter()
+                else:
+                    # Add the time since the last frame (exactly one step per frame when headless), dropping what is
+                    # beyond the catch-up limit so a long stall slows the game down instead of freezing it
+                    now = time.perf_counter()
+                    elapsed = self.step_time if self.headless else now - last_time
+                    last_time = now
+                    accumulator = min(accumulator + elapsed, self.max_catch_up * self.step_time)
+
+                    # Run the physics steps the elapsed time calls for
+                    while accumulator >= self.step_time and self.outcome is None and not self.paused:
+                        self.record_input(keys)
+                        self.character.keys = KeyState.from_mask(keys)
+                        self.remember_positions()
+                        self.update()
+                        accumulator -= self.step_time
+
+                    # Draw the game part of the way from the previous physics step to the latest one (headless games draw the latest step)
+                    rects = self.draw(None if self.headless else accumulator / self.step_time)
+
+                # Update the display, or only the regions that changed in dirty-rect mode
+                if rects is None:
+                    pygame.display.flip()
+                else:
+                    pygame.display.update(rects)
+                self.profiler.mark("flip")
 
-            # Draw TV banner
-            self.tv_banner.draw(self.screen)
+                # Report the cold-start time once the first frame is on screen
+                frames += 1
+                if frames == 1:
+                    STARTUP.mark("first game frame")
+                    if STARTUP.enabled:
+                        STARTUP.report()
 
-            # Update the display
-            pygame.display.flip()
+                # Control frame rate (0 draws as fast as possible)
+                self.clock.tick(self.max_fps)
+                self.profiler.mark("wait")
+                self.profiler.end_frame()
+        finally:
+            self.save_recording()
 
-            # Control frame rate
-            self.clock.tick(60)
+        # Return the outcome to the caller
+        return self.outcome
 
 
-# Set up a fullscreen display
-start_screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
+def run_start_screen(game_options):
+    # Set up a fullscreen display
+    start_screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
 
-# Load and scale the background image to fit the screen
-image = pygame.image.load('img_start_background.png')
-image = pygame.transform.scale(image, (start_screen.get_width(), start_screen.get_height()))
+    # Load and scale the background image to fit the screen
+    image = ASSETS.load_image('img_start_background.png', (start_screen.get_width(), start_screen.get_height()), pixel_format=None)
 
-# Blit the background image onto the screen at coordinates (0, 0)
-start_screen.blit(image, (0, 0))
+    # Blit the background image onto the screen at coordinates (0, 0)
+    start_screen.blit(image, (0, 0))
 
-# Load and play the start sound effect
-start_sound = pygame.mixer.Sound('audio_starter.mp3')
-start_sound.play()
+    # Load and play the start sound effect
+    start_sound = SOUNDS.load_sound('audio_starter.mp3')
+    VOICES.play(start_sound)
 
-# Update the display to show the background image and sound effect
-pygame.display.flip()
+    # Update the display to show the background image and sound effect
+    pygame.display.flip()
+    STARTUP.mark("start screen shown")
 
-# Define the font for the buttons
-font = pygame.font.Font("font1.ttf", 24)
+    # Start decoding the game's images and sounds in the background while the start screen is showing
+    preloader = AssetPreloader(*game_assets())
 
-# Create "PLAY" button with specific properties using the Button class
-play_button = Button((start_screen.get_width() // 2 - 100, 550, 200, 50), "PLAY", LIGHT_GRAY, DARK_GRAY, DARKER_GRAY, BLACK, font, 20, 4)
+    # Define the font for the buttons
+    font = pygame.font.Font("font1.ttf", 24)
 
-# Create "QUIT" button with specific properties using the Button class
-quit_button = Button((start_screen.get_width() // 2 - 100, 650, 200, 50), "QUIT", LIGHT_GRAY, DARK_GRAY, DARKER_GRAY, BLACK, font, 20, 4)
+    # Create "PLAY" button with specific properties using the Button class
+    play_button = Button((start_screen.get_width() // 2 - 100, 550, 200, 50), "PLAY", LIGHT_GRAY, DARK_GRAY, DARKER_GRAY, BLACK, font, 20, 4)
 
-# Store the buttons in a list for easy access
-buttons = [play_button, quit_button]
+    # Create "QUIT" button with specific properties using the Button class
+    quit_button = Button((start_screen.get_width() // 2 - 100, 650, 200, 50), "QUIT", LIGHT_GRAY, DARK_GRAY, DARKER_GRAY, BLACK, font, 20, 4)
 
-while True:
-    # Event handling loop
-    for event in pygame.event.get():
-        # If the event is quitting the game, exit the program
-        if event.type == pygame.QUIT:
-            pygame.quit()
-            sys.exit()
+    # Store the buttons in a list for easy access
+    buttons = [play_button, quit_button]
 
-        # If a key is pressed and it's the escape key, exit the program
-        elif event.type == pygame.KEYDOWN:
-            if event.key == pygame.K_ESCAPE:
+    while True:
+        # Event handling loop
+        for event in pygame.event.get():
+            # If the event is quitting the game, exit the program
+            if event.type == pygame.QUIT:
                 pygame.quit()
                 sys.exit()
 
-        # Check if any button is clicked
-        for button in buttons:
-            if button.handle_event(event):
-                # If the "PLAY" button is clicked, start the game
-                if button.text == "PLAY":
-                    game = Game()
-                    game.run()
-
-                # If the "QUIT" button is clicked, exit the program
-                elif button.text == "QUIT":
+            # If a key is pressed and it's the escape key, exit the program
+            elif event.type == pygame.KEYDOWN:
+                if event.key == pygame.K_ESCAPE:
                     pygame.quit()
                     sys.exit()
 
-    # Redraw the background image and buttons on the start screen
-    start_screen.blit(image, (0, 0))
-    for button in buttons:
-        button.draw(start_screen)
-
-    # Update the display
-    pygame.display.flip()
+            # Check if any button is clicked
+            for button in buttons:
+                if button.handle_event(event):
+                    # If the "PLAY" button is clicked, start the game
+                    if button.text == "PLAY":
+                        preloader.finish()
+                        game = Game(**game_options)
+                        game.run()
+
+                    # If the "QUIT" button is clicked, exit the program
+                    elif button.text == "QUIT":
+                        pygame.quit()
+                        sys.exit()
+
+        # Install the assets decoded since the last frame
+        preloader.poll()
+
+        # Redraw the background image, buttons and loading progress on the start screen
+        start_screen.blit(image, (0, 0))
+        for button in buttons:
+            button.draw(start_screen)
+        preloader.draw(start_screen, (start_screen.get_width() // 2 - 100, 520, 200, 10))
+
+        # Update the display
+        pygame.display.flip()
+
+
+def main(argv=None):
+    # Read the command line options
+    parser = argparse.ArgumentParser(description="Mighty Action Game")
+    parser.add_argument("--headless", action="store_true", default=HEADLESS, help="run without a window or sound and skip the start screen")
+    parser.add_argument("--silent", action="store_true", help="run without sound")
+    parser.add_argument("--seed", type=int, help="seed of the level and item drops")
+    parser.add_argument("--level", help="level file to play instead of a generated level")
+    parser.add_argument("--dirty-rects", action="store_true", help="redraw only the parts of the screen that changed")
+    parser.add_argument("--batched-enemies", action="store_true", help="keep the enemies in the NumPy enemy store")
+    parser.add_argument("--physics-hz", type=int, default=BASE_PHYSICS_HZ, help="physics steps per second (lower for weak hardware)")
+    parser.add_argument("--max-fps", type=int, help="frame-rate cap (0 draws as fast as possible, default 60)")
+    parser.add_argument("--frames", type=int, help="stop a headless game after this many frames")
+    parser.add_argument("--startup-report", action="store_true", help="print the time from launch to the first frame")
+    parser.add_argument("--record", help="record the input of the game to this file")
+    parser.add_argument("--replay", help="replay an input recording headless as fast as possible")
+    args = parser.parse_args(argv)
+
+    # Replays run headless without the start screen and report how fast they ran
+    if args.replay:
+        recording = InputRecording.load(args.replay)
+        start = time.perf_counter()
+        game, steps = recording.replay(batched_enemies=args.batched_enemies)
+        seconds = time.perf_counter() - start
+        print("Replayed %d steps (%.1f s of play at %d Hz) in %.2f s, %.0f steps/s, outcome: %s" % (steps, steps / game.physics_hz, game.physics_hz, seconds, steps / seconds, game.outcome or "none"))
+        return 0
+
+    # Open only the pygame modules this run needs
+    STARTUP.enabled = args.startup_report
+    init_display(args.headless)
+    init_audio(args.silent or args.headless)
+    init_fonts()
+    game_options = {"headless": args.headless, "silent": args.silent or args.headless, "seed": args.seed, "level_path": args.level,
+                    "dirty_rects": args.dirty_rects, "batched_enemies": args.batched_enemies, "record_path": args.record,
+                    "physics_hz": args.physics_hz, "max_fps": args.max_fps}
+
+    # Headless runs skip the start screen and play the game straight away
+    if args.headless:
+        outcome = Game(**game_options).run(args.frames)
+        print("Game ended: %s" % (outcome or "stopped"))
+        return 0
+    run_start_screen(game_options)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
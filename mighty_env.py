@@ -0,0 +1,266 @@
+# Step/reset environment around the game for automated players, and a vectorised version running many games in worker processes
+#
+# Usage:
+#   env = MightyEnv(seed=1)
+#   observation, info = env.reset()
+#   observation, reward, terminated, truncated, info = env.step(RIGHT_JUMP)
+#
+#   envs = VectorEnv(16, workers=4, seed=1)
+#   observations = envs.reset()
+#   observations, rewards, terminated, truncated = envs.step(actions)
+#   envs.close()
+#
+#   python mighty_env.py --envs 16 --workers 1 --workers 2 --workers 4   # measure steps per second
+
+import os
+import time
+import argparse
+import multiprocessing
+from multiprocessing import shared_memory
+
+import numpy as np
+
+# Keep pygame from printing its banner in every worker process
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+
+import main
+
+# Actions as input masks (no menu actions)
+NOOP, LEFT, RIGHT, JUMP, LEFT_JUMP, RIGHT_JUMP = range(6)
+ACTIONS = [0, main.INPUT_LEFT, main.INPUT_RIGHT, main.INPUT_UP, main.INPUT_LEFT | main.INPUT_UP, main.INPUT_RIGHT | main.INPUT_UP]
+
+# Nearest enemies described in an observation, and the size in blocks of the block grid around the character
+OBSERVED_ENEMIES = 4
+GRID_COLUMNS = 16
+GRID_ROWS = 12
+
+# Observation layout: character state, then (dx, dy, present) per enemy, then the block occupancy grid
+CHARACTER_FEATURES = 8
+OBSERVATION_SIZE = CHARACTER_FEATURES + OBSERVED_ENEMIES * 3 + GRID_COLUMNS * GRID_ROWS
+
+# Commands the vectorised environment gives its workers through shared memory
+COMMAND_RESET, COMMAND_STEP, COMMAND_CLOSE = range(3)
+
+
+class MightyEnv:
+    def __init__(self, seed=None, max_steps=3600, level_length=main.LEVEL_LENGTH, batched_enemies=False):
+        # Seed of the next game (each reset moves on to the next seed), and settings of every game
+        self.seed = seed
+        self.max_steps = max_steps
+        self.level_length = level_length
+        self.batched_enemies = batched_enemies
+
+        # Game being played and the number of steps taken in it
+        self.game = None
+        self.steps = 0
+
+    def reset(self, seed=None):
+        # Start a new game headless and silent
+        if seed is not None:
+            self.seed = seed
+        self.game = main.Game(headless=True, silent=True, seed=self.seed, level_length=self.level_length, batched_enemies=self.batched_enemies)
+        if self.seed is not None:
+            self.seed += 1
+        self.steps = 0
+        return self.observe(), {"seed": self.game.seed}
+
+    def step(self, action):
+        # Play one physics step with the action's keys held down
+        character = self.game.character
+        x, health = character.rect.x, character.health
+        outcome = self.game.step_input(ACTIONS[action])
+        self.steps += 1
+
+        # Reward progress to the right and health, with a bonus for reaching the castle and a penalty for dying
+        reward = (character.rect.x - x) / main.BLOCK_SIZE + (character.health - health) / 100
+        if outcome == "win":
+            reward += 50
+        elif outcome == "game_over":
+            reward -= 50
+
+        # The episode ends with the game, or is cut off after the step limit
+        terminated = outcome is not None
+        truncated = not terminated and self.steps >= self.max_steps
+        return self.observe(), reward, terminated, truncated, {"outcome": outcome, "x": character.rect.x}
+
+    def observe(self, out=None):
+        # Describe the game around the character as a vector of floats (written into out if given)
+        game = self.game
+        character = game.character
+        rect = character.rect
+        observation = np.zeros(OBSERVATION_SIZE, dtype=np.float32) if out is None else out
+        observation[:] = 0
+
+        # Character position on screen, speed, ground contact, health and position in the level
+        observation[:CHARACTER_FEATURES] = (
+            (rect.x - game.camera_x) / main.SCREEN_WIDTH, rect.y / main.SCREEN_HEIGHT,
+            character.speed_x / 10, character.speed_y / 20, character.on_ground,
+            character.health / character.max_health, character.jump_count / 2,
+            rect.x / (game.level.length * main.BLOCK_SIZE) if game.level.length else 0.0)
+
+        # Offsets of the nearest living enemies, in blocks
+        if game.enemy_store is not None:
+            store = game.enemy_store
+            indices = store.visible(rect.centerx - main.SCREEN_WIDTH, rect.centerx + main.SCREEN_WIDTH)
+            enemies = [(store.x[index] + store.width / 2, store.y[index] + store.height / 2) for index in indices]
+        else:
+            enemies = [enemy.rect.center for enemy in game.enemies]
+        enemies.sort(key=lambda center: abs(center[0] - rect.centerx))
+        offset = CHARACTER_FEATURES
+        for center_x, center_y in enemies[:OBSERVED_ENEMIES]:
+            observation[offset:offset + 3] = ((center_x - rect.centerx) / main.BLOCK_SIZE, (center_y - rect.centery) / main.BLOCK_SIZE, 1.0)
+            offset += 3
+
+        # Which cells of the block grid around the character hold a block
+        cells = game.block_grid.cells
+        first_column = rect.centerx // main.BLOCK_SIZE - GRID_COLUMNS // 2
+        first_row = rect.centery // main.BLOCK_SIZE - GRID_ROWS // 2
+        offset = CHARACTER_FEATURES + OBSERVED_ENEMIES * 3
+        for row in range(GRID_ROWS):
+            for column in range(GRID_COLUMNS):
+                if cells.get((first_column + column, first_row + row)):
+                    observation[offset + row * GRID_COLUMNS + column] = 1.0
+        return observation
+
+
+def worker_loop(start, done, memory_names, first, count, seed, env_options):
+    # Attach to the shared buffers: this worker writes its slice of the results and reads its slice of the actions
+    memories = [shared_memory.SharedMemory(name=name) for name in memory_names]
+    total = first + count
+    observations = np.ndarray((total, OBSERVATION_SIZE), dtype=np.float32, buffer=memories[0].buf)[first:]
+    rewards = np.ndarray(total, dtype=np.float32, buffer=memories[1].buf)[first:]
+    flags = np.ndarray((total, 2), dtype=np.bool_, buffer=memories[2].buf)[first:]
+    actions = np.ndarray(total, dtype=np.int64, buffer=memories[3].buf)[first:]
+    command = np.ndarray(1, dtype=np.int64, buffer=memories[4].buf)
+
+    # Each environment gets its own run of seeds
+    envs = [MightyEnv(seed=None if seed is None else seed + (first + index) * 1000003, **env_options) for index in range(count)]
+    while True:
+        # Wait for the next command, then carry it out and signal that this worker is done
+        start.acquire()
+        if command[0] == COMMAND_RESET:
+            for index, env in enumerate(envs):
+                env.reset()
+                env.observe(observations[index])
+        elif command[0] == COMMAND_STEP:
+            # Step every environment, starting a new game in the ones that ended (their observation is the new game's first)
+            for index, env in enumerate(envs):
+                observation, reward, terminated, truncated, info = env.step(actions[index])
+                rewards[index] = reward
+                flags[index] = (terminated, truncated)
+                if terminated or truncated:
+                    env.reset()
+                env.observe(observations[index])
+        else:
+            break
+        done.release()
+
+    # Detach from the shared buffers
+    for memory in memories:
+        memory.close()
+
+
+class VectorEnv:
+    def __init__(self, num_envs, workers=None, seed=None, **env_options):
+        # Spread the environments over the worker processes as evenly as possible
+        self.num_envs = num_envs
+        workers = min(num_envs, workers or multiprocessing.cpu_count())
+
+        # Observations, rewards and (terminated, truncated) flags live in shared memory, written by the workers in place,
+        # next to the actions and the command the workers read, so no step has to be sent through a pipe
+        self.memories = [
+            shared_memory.SharedMemory(create=True, size=num_envs * OBSERVATION_SIZE * 4),
+            shared_memory.SharedMemory(create=True, size=num_envs * 4),
+            shared_memory.SharedMemory(create=True, size=num_envs * 2),
+            shared_memory.SharedMemory(create=True, size=num_envs * 8),
+            shared_memory.SharedMemory(create=True, size=8),
+        ]
+        self.observations = np.ndarray((num_envs, OBSERVATION_SIZE), dtype=np.float32, buffer=self.memories[0].buf)
+        self.rewards = np.ndarray(num_envs, dtype=np.float32, buffer=self.memories[1].buf)
+        self.flags = np.ndarray((num_envs, 2), dtype=np.bool_, buffer=self.memories[2].buf)
+        self.actions = np.ndarray(num_envs, dtype=np.int64, buffer=self.memories[3].buf)
+        self.command = np.ndarray(1, dtype=np.int64, buffer=self.memories[4].buf)
+
+        # Start the workers, each woken through a semaphore of its own and counting itself done on one shared semaphore
+        context = multiprocessing.get_context("spawn")
+        self.starts = []
+        self.done = context.Semaphore(0)
+        self.processes = []
+        names = [memory.name for memory in self.memories]
+        first = 0
+        for worker in range(workers):
+            count = num_envs // workers + (1 if worker < num_envs % workers else 0)
+            start = context.Semaphore(0)
+            process = context.Process(target=worker_loop, args=(start, self.done, names, first, count, seed, env_options), daemon=True)
+            process.start()
+            self.starts.append(start)
+            self.processes.append(process)
+            first += count
+
+    def send(self, command):
+        # Wake every worker with a command and wait until all of them have finished it, failing if a worker died on the way
+        self.command[0] = command
+        for start in self.starts:
+            start.release()
+        for _ in self.starts:
+            while not self.done.acquire(timeout=1):
+                if not all(process.is_alive() for process in self.processes):
+                    raise RuntimeError("A worker of the vectorised environment stopped")
+
+    def reset(self):
+        # Start a new game in every environment
+        self.send(COMMAND_RESET)
+        return self.observations.copy()
+
+    def step(self, actions):
+        # Step every environment with its action; environments that ended start over on their own
+        self.actions[:] = actions
+        self.send(COMMAND_STEP)
+        return self.observations.copy(), self.rewards.copy(), self.flags[:, 0].copy(), self.flags[:, 1].copy()
+
+    def close(self):
+        # Stop the workers and free the shared memory
+        self.command[0] = COMMAND_CLOSE
+        for start in self.starts:
+            start.release()
+        for process in self.processes:
+            process.join()
+        for memory in self.memories:
+            memory.close()
+            memory.unlink()
+
+
+def measure(num_envs, workers, steps, seed):
+    # Step random actions through a vectorised environment and return the total steps per second
+    envs = VectorEnv(num_envs, workers=workers, seed=seed)
+    envs.reset()
+    rng = np.random.default_rng(seed)
+    start = time.perf_counter()
+    for _ in range(steps):
+        envs.step(rng.integers(0, len(ACTIONS), num_envs))
+    elapsed = time.perf_counter() - start
+    envs.close()
+    return num_envs * steps / elapsed
+
+
+def main_env():
+    # Read the command line options
+    parser = argparse.ArgumentParser(description="Measure how many environment steps per second the vectorised environment runs.")
+    parser.add_argument("--envs", type=int, default=16, help="number of environments")
+    parser.add_argument("--workers", type=int, action="append", help="number of worker processes (can be repeated)")
+    parser.add_argument("--steps", type=int, default=1000, help="steps per environment")
+    parser.add_argument("--seed", type=int, default=1, help="seed of the first game")
+    args = parser.parse_args()
+
+    # Report the throughput for every worker count, and how it scales against one worker (which can only be linear up to the number of cores available)
+    cores = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count()
+    print("%d environments, %d CPU cores available" % (args.envs, cores))
+    baseline = None
+    for workers in args.workers or [1, 2, 4]:
+        rate = measure(args.envs, workers, args.steps, args.seed)
+        baseline = baseline or rate / workers
+        print("%3d workers  %10.0f steps/s  scaling efficiency %.2f" % (workers, rate, rate / baseline / workers))
+
+
+if __name__ == "__main__":
+    main_env()